@@ -3,9 +3,10 @@ from lib.memory import Memory
 from lib.register import Register
 from lib.clock import Clock
 from lib.flagregister import FlagRegister
+from lib.output import OutputSink
 
 class CPU:
-    def __init__(self, clockspeed = 1_000_000):
+    def __init__(self, clockspeed = 1_000_000, output = None):
         # Memory
         self.RAM = Memory(16)
 
@@ -23,6 +24,9 @@ class CPU:
 
         self.IO = Register("IO") # input/output register
 
+        # Output sink - OUT values are buffered and displayed in batches (pass one in to capture or redirect them)
+        self.output = output or OutputSink()
+
         self.registers = [
             self.A,
             self.B,
@@ -53,9 +57,13 @@ class CPU:
     def run(self):
         self.clock.reset()
 
-        while not self.flag["Halt"]:
-            self.fetch_instruction()
-            self.execute_instruction()
+        try:
+            while not self.flag["Halt"]:
+                self.fetch_instruction()
+                self.execute_instruction()
+
+        finally:
+            self.output.flush()
 
 
     def reset(self):
@@ -111,7 +119,7 @@ class CPU:
 
     def OUT(self):
         self.A.transfer_to(self.IO)
-        print(f"{self.IO.value:08b}")
+        self.output.write(self.IO.value)
 
 
     def HLT(self):
@@ -8,6 +8,9 @@ class Memory:
         self.max_value = 2 ** bits - 1
 
         self.memory = [0] * size
+
+        # list of (address, old value, new value) tuples - set by a trace recorder to capture writes
+        self.write_log = None
     
 
     def __getitem__(self, address):
@@ -15,6 +18,9 @@ class Memory:
 
 
     def __setitem__(self, address, value):
+        if self.write_log is not None:
+            self.write_log.append((address, self.memory[address], value & self.max_value))
+
         self.memory[address] = value & self.max_value
 
 
@@ -0,0 +1,95 @@
+'''Module for the output sink - collects OUT values and writes them out in batches, formatted at flush time'''
+
+import sys
+import threading
+import time
+
+FORMATS = {
+    "bin" : lambda values: "".join(f"{value:08b}\n" for value in values),
+    "hex" : lambda values: "".join(f"{value:02x}\n" for value in values),
+    "binhex" : lambda values: "".join(f"\n{value:08b} {value:02x}\n" for value in values),
+    "ascii" : lambda values: values.decode("latin-1"),
+}
+
+
+class OutputSink:
+    '''
+    Buffer between OUT and wherever its values are displayed, so output doesn't run at terminal speed
+
+    Values are kept as bytes until the buffer holds batch_size of them, or flush() is called - then they're
+    formatted and written in one go. A background thread also flushes within interval seconds of a value arriving,
+    so output shows up while a program runs on, even if it never outputs anything else.
+
+    file     text file to write to - None writes to whatever sys.stdout is when flushing
+    format   one of FORMATS, or a function turning a bytes object into text
+    capture  also keep every value ever output in self.captured, e.g. for headless runs
+    display  write values out at all - False just captures them (or drops them)
+    '''
+
+    def __init__(self, file = None, format = "bin", batch_size = 4096, interval = 0.05, capture = False, display = True):
+        self.file = file
+        self.format = FORMATS[format] if isinstance(format, str) else format
+        self.batch_size = batch_size
+        self.interval = interval
+        self.display = display
+
+        self.pending = bytearray()
+        self.captured = bytearray() if capture else None
+
+        # the flushing thread is started by the first value displayed, and woken by each value after a flush
+        self.lock = threading.Lock()
+        self.waiting = threading.Event()
+        self.thread = None
+
+
+    def write(self, value):
+        if self.captured is not None:
+            self.captured.append(value)
+
+        if not self.display:
+            return
+
+        with self.lock:
+            self.pending.append(value)
+            full = len(self.pending) >= self.batch_size
+
+        if full:
+            self.flush()
+
+        elif not self.waiting.is_set():
+            self.waiting.set()
+
+            if self.thread is None:
+                self.thread = threading.Thread(target = self.flusher, daemon = True)
+                self.thread.start()
+
+
+    def flusher(self):
+        while self.waiting.wait():
+            self.waiting.clear()
+
+            # let the rest of the batch arrive first
+            time.sleep(self.interval)
+            self.flush()
+
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+
+            file = self.file or sys.stdout
+            file.write(self.format(bytes(self.pending)))
+            file.flush()
+
+            self.pending.clear()
+
+
+    def discard(self, captured = None):
+        '''Drop anything not yet written out - and with captured, drop captured values past that many'''
+
+        with self.lock:
+            self.pending.clear()
+
+        if captured is not None and self.captured is not None:
+            del self.captured[captured:]
@@ -3,10 +3,12 @@ from lib.memory import Memory
 from lib.register import Register
 from lib.clock import Clock
 from lib.flagregister import FlagRegister
+from lib.output import OutputSink
+from lib.input import InputDevice
 from lib.instructions import *
 
 class CPU:
-    def __init__(self, clockspeed = 1_000_000):
+    def __init__(self, clockspeed = 1_000_000, output = None):
         '''Initialize CPU hardware'''
         
         # Memory
@@ -34,6 +36,12 @@ class CPU:
         self.IN = self.registers.append(Register("IN")) or self.registers[-1] # input port
         self.OUT = self.registers.append(Register("OUT")) or self.registers[-1] # output port
 
+        # Output sink - OUT values are buffered and displayed in batches (pass one in to capture or redirect them)
+        self.output = output or OutputSink()
+
+        # Input device - IN reads the next byte from its ring buffer
+        self.input = InputDevice()
+
         # Flag Register
         self.flags = FlagRegister(
             "halt",
@@ -59,9 +67,13 @@ class CPU:
 
     
     def run(self):
-        while not self.flags["halt"]:
-            self.fetch_instruction()
-            self.execute_instruction()
+        try:
+            while not self.flags["halt"]:
+                self.fetch_instruction()
+                self.execute_instruction()
+
+        finally:
+            self.output.flush()
 
 
     '''Helper methods'''
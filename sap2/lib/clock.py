@@ -8,9 +8,12 @@ class Clock:
         self.start_time = 0
         self.stopped = False
 
+        self.cycles = 0
+
 
     def reset(self):
         self.stopped = False
+        self.cycles = 0
         self.start_time = time.perf_counter()
 
 
@@ -19,6 +22,8 @@ class Clock:
 
 
     def pulse(self, cycles = 1):
+        self.cycles += cycles
+
         if not self.stopped:
             expected_time = cycles * self.cycle_time
             elapsed_time = time.perf_counter() - self.start_time
@@ -0,0 +1,95 @@
+'''Module for the input device - a ring buffer of bytes for IN, fed from a script, a file, or stdin'''
+
+import os
+import threading
+import time
+
+# status port bits
+DATA_READY = 0x01
+END_OF_INPUT = 0x02
+
+
+class InputDevice:
+    '''
+    Ring buffer between an input source and IN, so reading input never blocks the emulation
+
+    Bytes are fed in directly with feed(), or by a background thread reading a file (or stdin) with feed_from().
+    IN takes the next byte, or 0 if there isn't one yet - the SAP-2 has no port numbers for a status port,
+    so programs poll by checking for 0. status() gives DATA_READY and END_OF_INPUT bits for the UI.
+    '''
+
+    def __init__(self, capacity = 4096):
+        self.buffer = bytearray(capacity)
+        self.capacity = capacity
+
+        # total bytes read and written - only ever increase, so the thread feeding the buffer never needs a lock
+        self.head = 0
+        self.tail = 0
+
+        self.closed = False
+        self.thread = None
+
+
+    @property
+    def available(self):
+        return self.tail - self.head
+
+
+    def feed(self, data):
+        '''Add as many bytes as fit - returns how many that was'''
+
+        count = min(len(data), self.capacity - (self.tail - self.head))
+        start = self.tail % self.capacity
+        first = min(count, self.capacity - start)
+
+        self.buffer[start:start + first] = data[:first]
+        self.buffer[:count - first] = data[first:count]
+        self.tail += count
+
+        return count
+
+
+    def feed_from(self, file, chunk_size = 256):
+        '''Feed the buffer from a binary file in a background thread, waiting for room when it's full'''
+
+        self.closed = False
+        self.thread = threading.Thread(target = self.reader, args = (file, chunk_size), daemon = True)
+        self.thread.start()
+
+
+    def reader(self, file, chunk_size):
+        try:
+            fileno = file.fileno()
+        except (AttributeError, OSError):
+            fileno = None
+
+        while (data := os.read(fileno, chunk_size) if fileno is not None else file.read(chunk_size)):
+            while data:
+                data = data[self.feed(data):]
+
+                if data:
+                    time.sleep(0.001)
+
+        self.closed = True
+
+
+    def close(self):
+        '''No more input is coming - sets END_OF_INPUT once the buffer is empty'''
+
+        self.closed = True
+
+
+    def read(self):
+        if self.head == self.tail:
+            return 0
+
+        value = self.buffer[self.head % self.capacity]
+        self.head += 1
+        return value
+
+
+    def status(self):
+        if self.head != self.tail:
+            return DATA_READY
+
+        return END_OF_INPUT if self.closed else 0
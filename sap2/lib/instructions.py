@@ -84,9 +84,10 @@ def HLT(cpu):
 
 
 def IN(cpu):
+    cpu.IN.value = cpu.input.read()
     cpu.A.transfer_from(cpu.IN)
 
-    cpu.clock.update(4)
+    cpu.clock.pulse(4)
     
     
 def INRA(cpu):
@@ -252,8 +253,7 @@ def ORI(cpu):
 
 def OUT(cpu):
     cpu.A.transfer_to(cpu.OUT)
-
-    print(f"\n{cpu.A.value:08b} {cpu.A.value:02x}")
+    cpu.output.write(cpu.OUT.value)
 
     cpu.clock.pulse(4)
 
@@ -9,6 +9,9 @@ class Memory:
         self.max_value = 2 ** width - 1
 
         self.contents = [0] * size
+
+        # list of (address, old value, new value) tuples - set by a trace recorder to capture writes
+        self.write_log = None
     
 
     def __getitem__(self, address):
@@ -16,6 +19,9 @@ class Memory:
 
 
     def __setitem__(self, address, value):
+        if self.write_log is not None:
+            self.write_log.append((address, self.contents[address], value & self.max_value))
+
         self.contents[address] = value & self.max_value
 
 
@@ -0,0 +1,267 @@
+'''Module for recording execution traces to a compact binary file and reading them back'''
+
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+
+'''
+Trace file layout
+
+Header:   magic (4s), version (H), register count (H)
+          then one (name (8s), width (B)) entry per traced register
+Records:  fixed-size (kind (B), byte (B), address (H), word (H), long (I))
+
+STEP  byte = opcode (the IR after the fetch), address = PC, word = next two bytes (operands), long = cycles since previous STEP
+REG   byte = register index, long = new register value - never PC or IR, which the STEP records already give
+MEM   byte = new value, address = address written, word = old value
+
+Each instruction is one STEP record followed by REG records for the registers it changed
+and MEM records for the memory it wrote, so unchanged state costs nothing
+'''
+
+MAGIC = b'SAPT'
+VERSION = 2
+
+HEADER = struct.Struct('<4sHH')
+REGISTER_ENTRY = struct.Struct('<8sB')
+RECORD = struct.Struct('<BBHHI')
+
+STEP = 0
+REG = 1
+MEM = 2
+
+
+class TraceWriter:
+    '''Runs a CPU one instruction at a time, streaming a record of each instruction to a file'''
+
+    def __init__(self, cpu, file, chunk_size = 1 << 20):
+        self.cpu = cpu
+        self.memory = cpu.memory
+        self.chunk_size = chunk_size
+
+        self.registers = list(cpu.registers)
+        self.previous = [register.value for register in self.registers]
+        self.previous_cycle = cpu.clock.cycles
+
+        # PC and IR are rebuilt from the STEP records, so they don't get REG records
+        self.changing = [i for i, register in enumerate(self.registers) if register.name not in ("PC", "IR")]
+
+        self.buffer = bytearray()
+        self.file = open(file, 'wb')
+
+        self.buffer += HEADER.pack(MAGIC, VERSION, len(self.registers))
+        for register in self.registers:
+            self.buffer += REGISTER_ENTRY.pack(register.name.encode('ascii'), register.width)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def step(self):
+        '''Execute and record a single instruction'''
+
+        cpu = self.cpu
+        memory = self.memory
+        buffer = self.buffer
+
+        pc = cpu.PC.value
+        operands = memory[(pc + 1) % memory.size] | memory[(pc + 2) % memory.size] << 8
+        cycle = cpu.clock.cycles
+
+        writes = memory.write_log = []
+
+        try:
+            cpu.fetch_instruction()
+            cpu.execute_instruction()
+
+        finally:
+            memory.write_log = None
+
+            # packed after the fetch, so an acknowledged interrupt is recorded as the RST it ran, not the byte at PC
+            buffer += RECORD.pack(STEP, cpu.IR.value, pc, operands, cycle - self.previous_cycle)
+            self.previous_cycle = cycle
+
+            for i in self.changing:
+                if (value := self.registers[i].value) != self.previous[i]:
+                    self.previous[i] = value
+                    buffer += RECORD.pack(REG, i, 0, 0, value)
+
+            for address, old, new in writes:
+                buffer += RECORD.pack(MEM, new, address, old, 0)
+
+            if len(buffer) >= self.chunk_size:
+                self.flush()
+
+
+    def run(self):
+        '''Record the program in memory until a HLT command is executed'''
+
+        while not self.cpu.flags["halt"]:
+            self.step()
+
+        self.flush()
+        self.cpu.output.flush()
+
+
+    def flush(self):
+        self.file.write(self.buffer)
+        self.buffer.clear()
+
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+
+class TraceReader:
+    '''Memory-mapped view of a trace file, indexed by PC and by written address'''
+
+    def __init__(self, file):
+        with open(file, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+        magic, version, register_count = HEADER.unpack_from(self.map, 0)
+
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Invalid Trace File: {file}")
+
+        self.register_names = []
+        self.register_widths = []
+
+        offset = HEADER.size
+        for _ in range(register_count):
+            name, width = REGISTER_ENTRY.unpack_from(self.map, offset)
+            self.register_names.append(name.rstrip(b'\0').decode('ascii'))
+            self.register_widths.append(width)
+            offset += REGISTER_ENTRY.size
+
+        self.data_offset = offset
+        self.record_count = (len(self.map) - offset) // RECORD.size
+
+        self.build_index()
+
+
+    def __len__(self):
+        return len(self.step_cycles)
+
+
+    def __getitem__(self, step):
+        '''Return (cycle, PC, opcode, operands, {register: value}, [(address, old, new)]) for one step'''
+
+        if step < 0:
+            step += len(self)
+
+        start = self.step_records[step]
+        end = self.step_records[step + 1] if step + 1 < len(self) else self.record_count
+
+        kind, opcode, pc, operands, _ = self.record(start)
+        registers = {}
+        writes = []
+
+        # PC and IR aren't stored as REG records - IR is the opcode, and PC is where the next step starts
+        if "IR" in self.register_names and (step == 0 or self.record(self.step_records[step - 1])[1] != opcode):
+            registers["IR"] = opcode
+
+        if "PC" in self.register_names and step + 1 < len(self) and self.step_pcs[step + 1] != pc:
+            registers["PC"] = self.step_pcs[step + 1]
+
+        for i in range(start + 1, end):
+            kind, byte, address, word, long = self.record(i)
+
+            if kind == REG:
+                registers[self.register_names[byte]] = long
+            else:
+                writes.append((address, word, byte))
+
+        return self.step_cycles[step], pc, opcode, operands, registers, writes
+
+
+    def record(self, index):
+        return RECORD.unpack_from(self.map, self.data_offset + index * RECORD.size)
+
+
+    def build_index(self):
+        '''Single pass over the records, building per-step arrays and the PC and address indexes'''
+
+        self.step_cycles = array('Q')
+        self.step_pcs = array('H')
+        self.step_records = array('Q')
+
+        # PC / address -> array of step numbers, in execution order
+        self.pc_index = {}
+        self.write_index = {}
+
+        records = memoryview(self.map)[self.data_offset:self.data_offset + self.record_count * RECORD.size]
+
+        cycle = 0
+        step = -1
+
+        for index, (kind, byte, address, word, long) in enumerate(RECORD.iter_unpack(records)):
+            if kind == STEP:
+                step += 1
+                cycle += long
+
+                self.step_cycles.append(cycle)
+                self.step_pcs.append(address)
+                self.step_records.append(index)
+
+                if address not in self.pc_index:
+                    self.pc_index[address] = array('Q')
+                self.pc_index[address].append(step)
+
+            elif kind == MEM:
+                if address not in self.write_index:
+                    self.write_index[address] = array('Q')
+                if not self.write_index[address] or self.write_index[address][-1] != step:
+                    self.write_index[address].append(step)
+
+        records.release()
+
+
+    def steps_at(self, pc):
+        '''All steps that executed the instruction at address pc'''
+
+        return list(self.pc_index.get(pc, ()))
+
+
+    def writes_to(self, address):
+        '''All steps that wrote to address'''
+
+        return list(self.write_index.get(address, ()))
+
+
+    def last_write(self, address, before_cycle = None):
+        '''
+        Return (step, cycle, PC, old value, new value) for the last write to address that
+        started before before_cycle (defaults to the end of the trace), or None if there isn't one
+        '''
+        steps = self.write_index.get(address)
+
+        if not steps:
+            return None
+
+        if before_cycle is None:
+            i = len(steps)
+        else:
+            i = bisect_left(steps, bisect_left(self.step_cycles, before_cycle))
+
+        if i == 0:
+            return None
+
+        step = steps[i - 1]
+        cycle, pc, _, _, _, writes = self[step]
+        old, new = [(old, new) for written, old, new in writes if written == address][-1]
+
+        return step, cycle, pc, old, new
+
+
+    def close(self):
+        self.map.close()
@@ -171,6 +171,7 @@ def step(cpu):
     if not cpu.flags["halt"]:
         cpu.fetch_instruction()
         cpu.execute_instruction()
+        cpu.output.flush()
         display_state(cpu)
 
     else:
@@ -0,0 +1,200 @@
+'''Benchmark suite for SAP-3 - times the core and devices running unthrottled, so changes can be compared'''
+
+import argparse
+import os
+import tempfile
+import time
+
+from cpu import CPU
+from lib.disk import DiskController, READ, WRITE
+from lib.dma import DMAController, START
+
+
+def timed(cpu):
+    '''Run the CPU unthrottled until it halts - returns the seconds taken'''
+
+    cpu.clock.stopped = True
+
+    start = time.perf_counter()
+    cpu.run()
+    return time.perf_counter() - start
+
+
+def core(scale):
+    '''Instruction throughput - a loop of register arithmetic, memory accesses, and jumps'''
+
+    loops = min(20_000 * scale, 0xFFFF)
+
+    program = [
+        0x21, 0x00, 0x80,       # LXI H,8000
+        0x01, loops & 0xFF, loops >> 8, # LXI B,loops
+        0x7E,                   # loop: MOV A,M
+        0x80,                   # ADD B
+        0x77,                   # MOV M,A
+        0x23,                   # INX H
+        0x0B,                   # DCX B
+        0x78,                   # MOV A,B
+        0xB1,                   # ORA C
+        0xC2, 0x06, 0x00,       # JNZ loop
+        0x76,                   # HLT
+    ]
+
+    cpu = CPU()
+    cpu.reset()
+    cpu.load(program)
+    seconds = timed(cpu)
+
+    return seconds, cpu.clock.cycles, f"{loops * 8 / seconds / 1000:.0f}k instructions/s"
+
+
+def disk(scale):
+    '''Disk throughput driven by the CPU - reads a track (26 sectors) into memory and writes it back, over the I/O ports'''
+
+    passes = min(200 * scale, 255)
+    base = 0x08
+
+    def out(port, value):
+        return [0x3E, value, 0xD3, port] # MVI A,value / OUT port
+
+    program = [
+        0x0E, passes,           # MVI C,passes
+        0x79,                   # loop: MOV A,C
+        0xE6, 0x3F,             # ANI 3F
+        0xD3, base,             # OUT base (track)
+        *out(base + 1, 1),      # sector 1
+        *out(base + 2, 0x00),   # transfer address 4000
+        *out(base + 3, 0x40),
+        *out(base + 4, 26),     # whole track
+        *out(base + 5, READ),
+        *out(base + 5, WRITE),
+        0x0D,                   # DCR C
+        0xC2, 0x02, 0x00,       # JNZ loop
+        0x76,                   # HLT
+    ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        cpu = CPU()
+        cpu.reset()
+        controller = DiskController(cpu, os.path.join(directory, "bench.dsk"), base)
+        cpu.load(program)
+        seconds = timed(cpu)
+
+        transferred = controller.bytes_read + controller.bytes_written
+        controller.close()
+
+    return seconds, cpu.clock.cycles, f"{transferred / seconds / 2**20:.1f} MiB/s disk I/O"
+
+
+def disk_raw(scale):
+    '''Disk throughput of the controller alone - whole-disk multi-sector transfers, without the CPU'''
+
+    passes = 50 * scale
+
+    with tempfile.TemporaryDirectory() as directory:
+        cpu = CPU()
+        controller = DiskController(cpu, os.path.join(directory, "bench.dsk"))
+        sectors = controller.sectors_per_track * 8
+
+        start = time.perf_counter()
+
+        for _ in range(passes):
+            for track in range(0, controller.tracks - 8, 8):
+                controller.read(track, 1, 0x1000, sectors)
+                controller.write(track, 1, 0x1000, sectors)
+
+        seconds = time.perf_counter() - start
+        transferred = controller.bytes_read + controller.bytes_written
+        controller.close()
+
+    return seconds, 0, f"{transferred / seconds / 2**20:.0f} MiB/s disk I/O"
+
+
+def copy_loop(scale):
+    '''Block copy done by the CPU - 8 KiB with an LDAX/STAX/INX/DCX loop'''
+
+    program = [
+        0x21, 0x00, 0x40,       # LXI H,4000 (source)
+        0x11, 0x00, 0x60,       # LXI D,6000 (destination)
+        0x01, 0x00, 0x20,       # LXI B,2000 (length)
+        0x7E,                   # loop: MOV A,M
+        0x12,                   # STAX D
+        0x23,                   # INX H
+        0x13,                   # INX D
+        0x0B,                   # DCX B
+        0x78,                   # MOV A,B
+        0xB1,                   # ORA C
+        0xC2, 0x09, 0x00,       # JNZ loop
+        0x76,                   # HLT
+    ]
+
+    seconds = cycles = 0
+
+    for _ in range(scale):
+        cpu = CPU()
+        cpu.reset()
+        cpu.load(program)
+        seconds += timed(cpu)
+        cycles += cpu.clock.cycles
+
+    return seconds, cycles, f"{0x2000 * scale / seconds / 2**20:.3f} MiB/s copied"
+
+
+def copy_dma(scale):
+    '''The same 8 KiB copy done by the DMA controller, many times over'''
+
+    passes = min(200 * scale, 255)
+    base = 0x20
+
+    def out(port, value):
+        return [0x3E, value, 0xD3, port] # MVI A,value / OUT port
+
+    program = [
+        *out(base + 0, 0x00), *out(base + 1, 0x40), # source 4000
+        *out(base + 2, 0x00), *out(base + 3, 0x60), # destination 6000
+        *out(base + 4, 0x00), *out(base + 5, 0x20), # length 2000
+        0x0E, passes,           # MVI C,passes
+        0x3E, START,            # loop: MVI A,START
+        0xD3, base + 7,         # OUT control
+        0x0D,                   # DCR C
+        0xC2, 0x1A, 0x00,       # JNZ loop
+        0x76,                   # HLT
+    ]
+
+    cpu = CPU()
+    cpu.reset()
+    controller = DMAController(cpu, base)
+    cpu.load(program)
+    seconds = timed(cpu)
+
+    return seconds, cpu.clock.cycles, f"{controller.bytes_transferred / seconds / 2**20:.0f} MiB/s copied"
+
+
+BENCHMARKS = {
+    "core" : core,
+    "disk" : disk,
+    "disk-raw" : disk_raw,
+    "copy-loop" : copy_loop,
+    "copy-dma" : copy_dma,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+
+    parser.add_argument("benchmarks", nargs = "*", choices = [[], *BENCHMARKS], help = "benchmarks to run (defaults to all)")
+    parser.add_argument("--scale", type = int, default = 1, help = "multiply the work done by each benchmark")
+    parser.add_argument("--repeat", type = int, default = 3, help = "runs per benchmark - the fastest is reported")
+
+    args = parser.parse_args()
+
+    print(f"{'benchmark':10}  {'seconds':>8}  {'MHz':>6}  result")
+
+    for name in args.benchmarks or BENCHMARKS:
+        seconds, cycles, result = min((BENCHMARKS[name](args.scale) for _ in range(args.repeat)), key = lambda run: run[0])
+        mhz = f"{cycles / seconds / 1e6:6.2f}" if cycles else f"{'-':>6}"
+
+        print(f"{name:10}  {seconds:8.3f}  {mhz}  {result}")
+
+
+if __name__ == '__main__':
+    main()
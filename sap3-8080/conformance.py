@@ -0,0 +1,179 @@
+'''Conformance runner - checks the SAP-3 instruction table against per-opcode JSON single-step test vectors'''
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+
+from cpu import CPU
+from lib.instructions import instruction_table
+
+'''
+Test vector format (one file per opcode, e.g. "3c.json", holding a list of tests)
+
+{
+    "name": "3c 0000",
+    "initial": {"pc": 0, "sp": 0, "a": 0, "b": 0, "c": 0, "d": 0, "e": 0, "f": 0, "h": 0, "l": 0, "ram": [[address, value], ...]},
+    "final": { same keys, with the expected values },
+    "cycles": number of cycles, or a list with one entry per cycle
+}
+
+Unknown register keys (e.g. "ei") are ignored, so vectors from the usual single-step test suites can be used as is.
+'''
+
+REGISTERS = ["a", "b", "c", "d", "e", "h", "l", "f", "sp", "pc"]
+
+_cpu = None
+
+
+class Result:
+    '''Results for one opcode's test file'''
+
+    def __init__(self, opcode):
+        self.opcode = opcode
+        self.tests = 0
+        self.passed = 0
+        self.cycle_mismatches = 0
+        self.errors = 0
+        self.first_failure = None
+
+
+    def fail(self, test, message):
+        if self.first_failure is None:
+            self.first_failure = f"{test.get('name', '?')}: {message}"
+
+
+
+def _start_worker():
+    global _cpu
+    _cpu = CPU()
+    _cpu.reset()
+    _cpu.clock.stopped = True
+    _cpu.output.display = False
+
+
+def run_file(file, flags_mask = 0xFF):
+    '''Run every test in one opcode's file on this process's CPU'''
+
+    cpu = _cpu
+    registers = {name: getattr(cpu, name.upper()) for name in REGISTERS}
+    memory = cpu.memory
+
+    result = Result(int(os.path.basename(file)[:2], 16))
+    empty = bytes(memory.size)
+
+    with open(file) as f:
+        tests = json.load(f)
+
+    for test in tests:
+        result.tests += 1
+
+        initial, final = test["initial"], test["final"]
+
+        memory.contents[:] = empty
+        cpu.halt = False
+
+        for name, register in registers.items():
+            register.value = initial.get(name, 0)
+
+        for address, value in initial.get("ram", []):
+            memory.contents[address] = value
+
+        start = cpu.clock.cycles
+
+        try:
+            cpu.fetch_instruction()
+            cpu.execute_instruction()
+        except Exception as exc:
+            result.errors += 1
+            result.fail(test, f"{type(exc).__name__}: {exc}")
+            continue
+
+        mismatches = []
+
+        for name, register in registers.items():
+            if name not in final:
+                continue
+
+            expected, actual = final[name], register.value
+
+            if name == "f":
+                expected, actual = expected & flags_mask, actual & flags_mask
+
+            if expected != actual:
+                mismatches.append(f"{name} {actual:x} != {expected:x}")
+
+        for address, value in final.get("ram", []):
+            if memory.contents[address] != value:
+                mismatches.append(f"[{address:04x}] {memory.contents[address]:02x} != {value:02x}")
+
+        cycles = test.get("cycles")
+        expected_cycles = len(cycles) if isinstance(cycles, list) else cycles
+
+        if expected_cycles is not None and cpu.clock.cycles - start != expected_cycles:
+            result.cycle_mismatches += 1
+
+            if not mismatches:
+                result.fail(test, f"cycles {cpu.clock.cycles - start} != {expected_cycles}")
+
+        if mismatches:
+            result.fail(test, ", ".join(mismatches))
+        elif expected_cycles is None or cpu.clock.cycles - start == expected_cycles:
+            result.passed += 1
+
+    return result
+
+
+def run(files, workers = None, flags_mask = 0xFF):
+    '''Run test files in parallel, returning a Result per opcode (sorted by opcode)'''
+
+    with multiprocessing.Pool(workers or os.cpu_count(), _start_worker) as pool:
+        results = pool.starmap(run_file, [(file, flags_mask) for file in files], chunksize = 1)
+
+    return sorted(results, key = lambda result: result.opcode)
+
+
+def print_summary(results):
+    print(f"\n{'op':2}  {'handler':8}  {'passed':>13}  {'cycles':>6}  {'errors':>6}  first failure")
+
+    for result in results:
+        handler = instruction_table[result.opcode].__name__ if result.opcode in instruction_table else "-"
+        status = f"{result.passed}/{result.tests}"
+
+        print(f"{result.opcode:02x}  {handler:8}  {status:>13}  {result.cycle_mismatches:6}  {result.errors:6}  {result.first_failure or ''}")
+
+    passing = sum(1 for result in results if result.passed == result.tests)
+    print(f"\n{passing}/{len(results)} opcodes passing, {sum(result.passed for result in results)}/{sum(result.tests for result in results)} tests passing")
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+
+    parser.add_argument("directory", help = "directory of per-opcode JSON test files (e.g. 3c.json)")
+    parser.add_argument("--opcodes", help = "comma separated hex opcodes to test (defaults to all files)")
+    parser.add_argument("--workers", type = int, help = "processes to use (defaults to one per core)")
+    parser.add_argument("--flags-mask", type = lambda text: int(text, 16), default = 0xFF,
+                        help = "flag bits to compare (hex), e.g. ed to skip the auxiliary carry and unused bits")
+
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(args.directory, "*.json")))
+
+    if args.opcodes:
+        opcodes = {int(opcode, 16) for opcode in args.opcodes.split(",")}
+        files = [file for file in files if int(os.path.basename(file)[:2], 16) in opcodes]
+
+    if not files:
+        print(f"No test files found in {args.directory}")
+        sys.exit(1)
+
+    results = run(files, args.workers, args.flags_mask)
+    print_summary(results)
+
+    sys.exit(0 if all(result.passed == result.tests for result in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+'''CP/M shim for SAP-3 - runs .COM programs at full speed, handling the console BDOS calls in Python'''
+
+import argparse
+import sys
+import time
+
+from cpu import CPU
+
+TPA = 0x0100
+BDOS_ENTRY = 0xFE06
+WBOOT_ENTRY = 0xFF03
+
+# returned by console input at the end of the input, like CP/M's ^Z
+EOF = 0x1A
+
+'''
+Memory map
+
+0000  JMP WBOOT       warm boot - a program returning from 0100 or jumping to 0000 exits
+0005  JMP BDOS        BDOS entry point - programs also read the top of their memory from 0006
+0100                  the .COM program (the TPA)
+FE00                  initial stack, holding the return address 0000
+FE06  RET             BDOS - calls are handled by an execute watchpoint here, before the RET runs
+FF03  HLT             WBOOT
+'''
+
+
+class BDOS:
+    '''
+    The console functions of the CP/M 2.2 BDOS
+
+    Output is buffered and written to the output file in chunks (and before any input is read, so prompts show).
+    Input comes from a bytes object if given, otherwise the input file.
+    Unsupported functions return 0, and file functions return FF (error).
+    '''
+
+    def __init__(self, cpu, input = None, output = None, input_file = None, chunk_size = 4096):
+        self.cpu = cpu
+        self.memory = cpu.memory
+
+        self.input = input
+        self.input_position = 0
+        self.input_file = input_file or sys.stdin.buffer
+
+        self.output = output or sys.stdout.buffer
+        self.buffer = bytearray()
+        self.chunk_size = chunk_size
+
+        self.exited = False
+        self.calls = 0
+
+        self.functions = {
+            0 : self.system_reset,
+            1 : self.console_input,
+            2 : self.console_output,
+            6 : self.direct_io,
+            9 : self.print_string,
+            10 : self.read_buffer,
+            11 : self.console_status,
+            12 : self.version,
+        }
+
+        cpu.watch(BDOS_ENTRY, kinds = "x", callback = self.call)
+        cpu.watch(WBOOT_ENTRY, kinds = "x", callback = self.warm_boot)
+
+
+    def call(self, address, kind, value):
+        cpu = self.cpu
+        self.calls += 1
+
+        if (function := self.functions.get(cpu.C.value)):
+            result = function()
+        else:
+            result = 0xFF if 13 <= cpu.C.value <= 40 else 0
+
+        # 8 bit results are returned in A and L, 16 bit ones in HL (and BA)
+        result = result or 0
+        cpu.L.value = cpu.A.value = result & 0xFF
+        cpu.H.value = cpu.B.value = result >> 8
+
+
+    def warm_boot(self, address, kind, value):
+        self.exited = True
+        self.flush()
+
+
+    '''Functions'''
+
+
+    def system_reset(self):
+        self.exited = True
+        self.cpu.stopped = True
+        self.flush()
+
+
+    def console_input(self):
+        char = self.read()
+        self.write(char)
+        return char
+
+
+    def console_output(self):
+        self.write(self.cpu.E.value)
+
+
+    def direct_io(self):
+        match self.cpu.E.value:
+            case 0xFF:
+                return self.read() if self.input_ready() else 0
+            case 0xFE:
+                return 0xFF if self.input_ready() else 0
+            case char:
+                self.write(char)
+
+
+    def print_string(self):
+        start = self.cpu.DE.value
+
+        if (end := self.memory.find(ord('$'), start)) == -1:
+            end = self.memory.size
+
+        self.buffer += self.memory.view(start, end - start)
+
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+
+    def read_buffer(self):
+        '''Read a line into the buffer at DE - byte 0 is its size, byte 1 gets the length, then the characters'''
+
+        address = self.cpu.DE.value
+        size = self.memory.peek(address)
+        line = bytearray()
+
+        while len(line) < size:
+            if (char := self.read()) in (0x0A, 0x0D, EOF):
+                break
+
+            line.append(char)
+
+        self.buffer += line + b'\r'
+
+        self.memory.poke(address + 1, len(line))
+
+        for i, char in enumerate(line):
+            self.memory.poke(address + 2 + i, char)
+
+
+    def console_status(self):
+        return 0xFF if self.input_ready() else 0
+
+
+    def version(self):
+        return 0x22
+
+
+    '''Console'''
+
+
+    def write(self, char):
+        self.buffer.append(char)
+
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+
+    def flush(self):
+        if self.buffer:
+            self.output.write(self.buffer)
+            self.output.flush()
+            self.buffer.clear()
+
+
+    def read(self):
+        self.flush()
+
+        if self.input is not None:
+            if self.input_position >= len(self.input):
+                return EOF
+
+            self.input_position += 1
+            return self.input[self.input_position - 1]
+
+        char = self.input_file.read(1)
+        return char[0] if char else EOF
+
+
+    def input_ready(self):
+        if self.input is not None:
+            return self.input_position < len(self.input)
+
+        # there's no portable way to check the terminal without blocking, so only scripted input is ever ready
+        return False
+
+
+
+def load(cpu, program):
+    '''Set up page zero, the BDOS and WBOOT stubs, and the stack, then load a .COM file (or bytes) at 0100'''
+
+    if isinstance(program, str):
+        with open(program, 'rb') as f:
+            program = f.read()
+
+    cpu.reset()
+    cpu.memory.clear()
+
+    cpu.load([0xC3, WBOOT_ENTRY & 0xFF, WBOOT_ENTRY >> 8, 0x00, 0x00, 0xC3, BDOS_ENTRY & 0xFF, BDOS_ENTRY >> 8])
+    cpu.load([0xC9], BDOS_ENTRY)
+    cpu.load([0x76], WBOOT_ENTRY)
+    cpu.load(program, TPA)
+
+    # return address of the program is 0000 (warm boot)
+    cpu.SP.value = BDOS_ENTRY - 6
+    cpu.memory.poke(cpu.SP.value, 0x00)
+    cpu.memory.poke(cpu.SP.value + 1, 0x00)
+
+    cpu.PC.value = TPA
+
+
+def run(program, input = None, output = None):
+    '''Run a .COM program unthrottled until it exits - returns the BDOS (for its call count) and the CPU'''
+
+    cpu = CPU()
+    load(cpu, program)
+    bdos = BDOS(cpu, input, output)
+
+    cpu.clock.stopped = True
+    cpu.run()
+    bdos.flush()
+
+    return bdos, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+
+    parser.add_argument("program", help = ".COM file to run")
+    parser.add_argument("--input", help = "text to use as console input instead of stdin (\\n separates lines)")
+    parser.add_argument("--stats", action = "store_true", help = "print cycles and effective speed when the program exits")
+
+    args = parser.parse_args()
+
+    input = args.input.encode().decode("unicode_escape").encode("latin-1") if args.input is not None else None
+
+    start = time.perf_counter()
+    bdos, cpu = run(args.program, input)
+    elapsed = time.perf_counter() - start
+
+    if args.stats:
+        print(f"\n{cpu.clock.cycles} cycles, {bdos.calls} BDOS calls in {elapsed:.2f}s ({cpu.clock.cycles / elapsed / 1e6:.2f} MHz)", file = sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,73 @@
 '''SAP-3 CPU'''
 
+import threading
+
 from lib.memory import Memory
 from lib.clock import Clock
+from lib.iobus import IOBus
+from lib.output import OutputSink
+from lib.input import InputDevice
+from lib.scheduler import Scheduler
+from lib.breakpoints import Breakpoint, ConditionScope
 from lib.registers import *
 from lib.instructions import *
 
+# ports of the built-in input device
+INPUT_DATA_PORT = 0x00
+INPUT_STATUS_PORT = 0x01
+
 class CPU:
     '''Main CPU class for managing the hardware of the SAP-3 CPU'''
 
-    def __init__(self, clockspeed = 1_000_000):
+    def __init__(self, clockspeed = 1_000_000, output = None):
         '''Initialize CPU hardware'''
 
         # Unofficial "halt" flag
         self.halt = False
+
+        # Set to stop run() once the current instruction finishes (e.g. by a watchpoint)
+        self.stopped = False
+        self.watch_hit = None
+
+        # Interrupts - the interrupt enable flip-flop (INTE), the RST vector of a requested interrupt,
+        # and whether one is both requested and enabled, so fetching only has to test one flag
+        self.interrupts_enabled = False
+        self.interrupt_request = None
+        self.interrupt_pending = False
+        self.enabled_at = None
+
+        # Devices on other threads that can request interrupts with post_interrupt (e.g. a UART receiving
+        # from a socket), and an event they set to wake a CPU halted waiting for one
+        self.interrupt_sources = 0
+        self.wake = threading.Event()
+
+        # Breakpoints - address: list of breakpoints at that address
+        self.breakpoints = {}
+        self.breakpoint_hit = None
         
         # Memory
         self.memory = Memory(2**16)
 
+        # Output sink - OUT values are buffered and displayed in batches (pass one in to capture or redirect them)
+        self.output = output or OutputSink()
+
+        # I/O bus - unmapped input ports read the IN register, and unmapped output ports go to the output sink
+        self.io = IOBus(self.read_input_register, self.output.output)
+
+        # Input device - a ring buffer read on the data port, polled on the status port
+        self.input = InputDevice()
+        self.io.attach(INPUT_DATA_PORT, self.input.input)
+        self.io.attach(INPUT_STATUS_PORT, self.input.status)
+
+        # Devices with state to save in checkpoints and snapshots - each one adds itself
+        self.devices = [self.input]
+
         # Clock
         self.clock = Clock(clockspeed)
 
+        # Device events, due at a cycle count
+        self.scheduler = Scheduler(self.clock)
+
         # Registers - create register variables while appending them to self.registers list
 
         self.registers = []
@@ -56,7 +104,8 @@ class CPU:
         self.WZ = self.registers.append(DoubleRegister("WZ", self.W, self.Z)) or self.registers[-1]
 
         # Flags register
-        self.F = self.registers.append(FlagsRegister("F", carry = 0, parity = 2, zero = 6, sign = 7)) or self.registers[-1]
+        self.F = self.registers.append(FlagsRegister("F", carry = 0, parity = 2, aux = 4, zero = 6, sign = 7)) or self.registers[-1]
+        self.F.fixed_bits = 0b10 # bit 1 of the 8080's flags always reads as 1
 
         # M pseudo-register
         self.M = self.registers.append(PseudoRegister("M", self.memory, self.HL)) or self.registers[-1]
@@ -70,9 +119,13 @@ class CPU:
         # Instruction register
         self.IR = self.registers.append(Register("IR")) or self.registers[-1]
 
-        # Output register
+        # Input & output registers
+        self.IN = self.registers.append(Register("IN")) or self.registers[-1]
         self.OUT = self.registers.append(Register("OUT")) or self.registers[-1]
 
+        # Name lookups for breakpoint conditions
+        self.condition_scope = ConditionScope(self)
+
         
     '''CPU operation methods'''
 
@@ -89,26 +142,249 @@ class CPU:
             if not isinstance(register, PseudoRegister):
                 register.clear()
 
+        # events, and devices that hold cycle counts, keep their timing relative to the reset
+        self.scheduler.rebase(self.clock.cycles)
+
+        for device in self.devices:
+            if hasattr(device, "rebase"):
+                device.rebase(self.clock.cycles)
+
         self.clock.reset()
 
         self.halt = False
+        self.stopped = False
+        self.watch_hit = None
+        self.breakpoint_hit = None
+
+        # "after" counts start again on every run
+        for breakpoints in self.breakpoints.values():
+            for breakpoint in breakpoints:
+                breakpoint.hits = 0
+
+        self.interrupts_enabled = False
+        self.interrupt_request = None
+        self.interrupt_pending = False
+        self.enabled_at = None
 
     
     def run(self):
-        '''Run the program in memory (from address 0) until a HLT command is executed'''
+        '''Run the program in memory (from address 0) until a HLT command is executed or the CPU is stopped'''
+
+        self.stopped = False
+
+        try:
+            if self.breakpoints:
+                self.run_with_breakpoints()
+                return
+
+            while not (self.halt or self.stopped):
+                self.fetch_instruction()
+                self.execute_instruction()
+
+        finally:
+            self.output.flush()
+
+
+    def run_with_breakpoints(self):
+        '''Same as run, but stops before executing an instruction whose breakpoint is hit'''
+
+        breakpoints = self.breakpoints
+
+        # continuing from a breakpoint - execute the instruction it stopped on first
+        if self.breakpoint_hit and self.breakpoint_hit.address == self.PC.value and not self.halt:
+            self.fetch_instruction()
+            self.execute_instruction()
+
+        self.breakpoint_hit = None
+
+        while not (self.halt or self.stopped):
+            if self.PC.value in breakpoints and self.check_breakpoints():
+                break
 
-        while not self.halt:
             self.fetch_instruction()
             self.execute_instruction()
 
 
+    def check_breakpoints(self):
+        for breakpoint in self.breakpoints[self.PC.value]:
+            if breakpoint.check(self.condition_scope):
+                self.breakpoint_hit = breakpoint
+                self.stopped = True
+
+        return self.stopped
+
+
+    def add_breakpoint(self, address = None, condition = None, after = 1):
+        '''Add a breakpoint - see lib.breakpoints.Breakpoint for the condition syntax'''
+
+        breakpoint = Breakpoint(self, address, condition, after)
+        self.breakpoints.setdefault(breakpoint.address, []).append(breakpoint)
+
+        return breakpoint
+
+
+    def remove_breakpoint(self, breakpoint):
+        self.breakpoints[breakpoint.address].remove(breakpoint)
+
+        if not self.breakpoints[breakpoint.address]:
+            del self.breakpoints[breakpoint.address]
+
+
+    def watch(self, start, end = None, kinds = "w", callback = None):
+        '''
+        Watch the addresses start - end (inclusive) for reads ("r"), writes ("w"), and/or executes ("x")
+        Without a callback, a hit stops run() after the current instruction and is stored in self.watch_hit
+        '''
+        return self.memory.watch(start, end, kinds, callback or self.stop_on_watchpoint)
+
+
+    def unwatch(self, watchpoint):
+        self.memory.unwatch(watchpoint)
+
+
+    def stop_on_watchpoint(self, address, kind, value):
+        self.watch_hit = (self.PC.value, address, kind, value)
+        self.stopped = True
+
+
+    def read_input_register(self, port):
+        return self.IN.value
+
+
+    '''Machine state'''
+
+
+    def save_state(self):
+        '''
+        Everything besides the registers, memory, and cycle count that decides what happens next -
+        the interrupt state, the scheduled events, and the state of each device in self.devices
+        '''
+
+        return (
+            (self.interrupts_enabled, self.interrupt_request, self.interrupt_pending, self.enabled_at),
+            self.scheduler.save_state(),
+            [device.save_state() for device in self.devices]
+        )
+
+
+    def load_state(self, state):
+        interrupts, events, devices = state
+
+        self.interrupts_enabled, self.interrupt_request, self.interrupt_pending, self.enabled_at = interrupts
+        self.scheduler.load_state(events)
+
+        for device, device_state in zip(self.devices, devices):
+            device.load_state(device_state)
+
+
+    '''Interrupts'''
+
+
+    def interrupt(self, vector):
+        '''
+        Request an interrupt - the device supplies RST vector (0 - 7), which is executed before the next instruction
+        once interrupts are enabled. The request is held until then, and a later request replaces it.
+        '''
+
+        if not 0 <= vector <= 7:
+            raise ValueError(f"Invalid RST vector: {vector}")
+
+        self.interrupt_request = vector
+        self.interrupt_pending = self.interrupts_enabled
+
+
+    def post_interrupt(self, vector):
+        '''Request an interrupt from another thread - it's made on the CPU's thread, at the next instruction boundary'''
+
+        if not 0 <= vector <= 7:
+            raise ValueError(f"Invalid RST vector: {vector}")
+
+        self.scheduler.post(lambda cycle: self.interrupt(vector))
+        self.wake.set()
+
+
+    def enable_interrupts(self):
+        self.interrupts_enabled = True
+        self.interrupt_pending = self.interrupt_request is not None
+
+        # interrupts aren't accepted until the instruction after EI finishes, so e.g. EI RET can return first
+        self.enabled_at = self.clock.cycles
+
+
+    def disable_interrupts(self):
+        self.interrupts_enabled = False
+        self.interrupt_pending = False
+
+
+    def can_be_interrupted(self):
+        '''Whether a scheduled event or a device on another thread can still request an interrupt'''
+
+        return self.interrupt_sources > 0 or self.scheduler.interrupting()
+
+
+    def wait_for_interrupt(self):
+        '''
+        Halted with interrupts enabled - skip the clock straight to each scheduled event until one interrupts
+        The skipped cycles still go through the clock, so a throttled run sleeps through them in real time.
+        When only devices on other threads can interrupt, block until one does (or the CPU is stopped).
+        '''
+
+        scheduler = self.scheduler
+
+        while not (self.interrupt_pending or self.stopped):
+            if scheduler.interrupting():
+                if scheduler.next_due > self.clock.cycles:
+                    self.clock.pulse(scheduler.next_due - self.clock.cycles)
+
+                scheduler.run_due()
+
+            elif self.interrupt_sources:
+                # checking stopped every so often, e.g. for a debugger's ^C
+                self.wake.wait(0.05)
+                self.wake.clear()
+                scheduler.run_due()
+
+            else:
+                break
+
+        if not self.interrupt_pending:
+            if self.stopped:
+                # back onto the HLT, so it's still waiting when run again
+                self.PC.dec()
+            else:
+                self.halt = True
+                self.clock.stop()
+
+
+    def acknowledge_interrupt(self):
+        '''Put the requested RST in the IR in place of a fetch, disabling interrupts - False if it has to wait'''
+
+        if self.clock.cycles == self.enabled_at:
+            return False
+
+        self.IR.value = 0xC7 | self.interrupt_request << 3
+        self.interrupt_request = None
+        self.disable_interrupts()
+
+        # an interrupt wakes the CPU from a HLT
+        self.halt = False
+
+        return True
+
+
     '''Helper methods'''
 
 
     def fetch_instruction(self):
-        '''Fetch the next instruction and load it into the IR'''
+        '''Fetch the next instruction and load it into the IR - or an RST, when an interrupt is acknowledged'''
+
+        if self.clock.cycles >= self.scheduler.next_due:
+            self.scheduler.run_due()
+
+        if self.interrupt_pending and self.acknowledge_interrupt():
+            return
 
-        self.IR.load(self.memory, self.PC.value)
+        self.IR.value = self.memory.fetch(self.PC.value)
         self.PC.inc()
 
 
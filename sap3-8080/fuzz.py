@@ -0,0 +1,268 @@
+'''Coverage-guided fuzzer for SAP-3 programs - mutates input bytes in memory or on the input port, restoring a snapshot for every execution'''
+
+import argparse
+import contextlib
+import multiprocessing
+import os
+import random
+import time
+
+from cpu import CPU
+from lib.snapshots import SnapshotStore
+
+INTERESTING_BYTES = [0x00, 0x01, 0x02, 0x0F, 0x10, 0x20, 0x40, 0x7F, 0x80, 0x81, 0xFE, 0xFF]
+
+
+class FuzzTarget:
+    '''
+    Where the program under test takes its input, and when an execution ends
+
+    program       file to load at address 0
+    entry         run the program's setup code up to here once, and snapshot it (None to start at address 0)
+    exit          an execution ends when PC reaches this address (or on a HLT)
+    input_address where each test case is written in memory - None feeds it to the input device (IN on port 0) instead,
+                  followed by END_OF_INPUT
+    input_length  number of bytes in each test case
+    budget        cycles an execution can use before it's reported as a hang
+    stack_guard   (start, end) addresses the stack must never write into
+    '''
+
+    def __init__(self, program, input_address, input_length, entry = None, exit = None, budget = 100_000, stack_guard = None):
+        self.program = program
+        self.input_address = input_address
+        self.input_length = input_length
+        self.entry = entry
+        self.exit = exit
+        self.budget = budget
+        self.stack_guard = stack_guard
+
+
+
+class Fuzzer:
+    '''Executes test cases against a target, collecting edge coverage (pairs of consecutive PCs)'''
+
+    def __init__(self, target, seed = None):
+        self.target = target
+        self.random = random.Random(seed)
+
+        self.cpu = CPU()
+        self.cpu.reset()
+        self.cpu.clock.stopped = True
+        self.cpu.output.display = False
+        self.cpu.load(target.program)
+
+        if target.entry is not None:
+            breakpoint = self.cpu.add_breakpoint(target.entry)
+            self.cpu.run()
+            self.cpu.remove_breakpoint(breakpoint)
+
+            if self.cpu.PC.value != target.entry:
+                raise ValueError(f"Program halted before reaching the entry point {target.entry:04x}")
+
+        if target.input_address is None and target.input_length > self.cpu.input.capacity:
+            raise ValueError(f"Test cases of {target.input_length} bytes don't fit the input buffer ({self.cpu.input.capacity} bytes)")
+
+        self.crash = None
+
+        if target.stack_guard:
+            self.cpu.watch(*target.stack_guard, "w", self.stack_runaway)
+
+        self.snapshots = SnapshotStore()
+        self.snapshots.save(self.cpu)
+
+        self.coverage = set()
+        self.corpus = []
+        self.crashes = {}
+        self.executions = 0
+
+
+    def stack_runaway(self, address, kind, value):
+        self.crash = "stack runaway"
+        self.cpu.stopped = True
+
+
+    def execute(self, data):
+        '''Run one test case - returns (edges, crash kind or None, PC at the end)'''
+
+        cpu = self.cpu
+        target = self.target
+
+        self.snapshots.load(cpu, 0)
+        cpu.clock.stopped = True
+        cpu.input.clear()
+
+        if target.input_address is None:
+            cpu.input.feed(data)
+            cpu.input.close()
+        else:
+            cpu.memory.copy_in(target.input_address, data)
+
+        self.crash = None
+        self.executions += 1
+
+        edges = set()
+        previous = 0
+        limit = cpu.clock.cycles + target.budget
+        exit = target.exit
+
+        try:
+            while not (cpu.halt or cpu.stopped):
+                pc = cpu.PC.value
+
+                if pc == exit:
+                    break
+
+                edges.add(previous ^ pc)
+                previous = pc >> 1
+
+                cpu.fetch_instruction()
+                cpu.execute_instruction()
+
+                if cpu.clock.cycles > limit:
+                    return edges, "cycle budget exceeded", cpu.PC.value
+
+        except ValueError:
+            return edges, "invalid opcode", cpu.PC.value - 1
+
+        return edges, self.crash, cpu.PC.value
+
+
+    def fuzz(self, seconds):
+        '''Mutate corpus entries for a while, keeping any that find new edges'''
+
+        end = time.perf_counter() + seconds
+
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            if not self.corpus:
+                self.try_input(bytes(self.target.input_length))
+
+            while time.perf_counter() < end:
+                self.try_input(self.mutate(self.random.choice(self.corpus)))
+
+
+    def try_input(self, data):
+        edges, crash, pc = self.execute(data)
+
+        if crash:
+            self.crashes.setdefault((crash, pc), data)
+
+        elif not edges <= self.coverage:
+            self.coverage |= edges
+            self.corpus.append(data)
+
+
+    def mutate(self, data):
+        data = bytearray(data)
+        rng = self.random
+
+        for _ in range(1 << rng.randrange(4)):
+            i = rng.randrange(len(data))
+
+            match rng.randrange(6):
+                case 0:
+                    data[i] ^= 1 << rng.randrange(8)
+                case 1:
+                    data[i] = rng.randrange(256)
+                case 2:
+                    data[i] = (data[i] + rng.randrange(-16, 17)) & 0xFF
+                case 3:
+                    data[i] = rng.choice(INTERESTING_BYTES)
+                case 4:
+                    other = rng.choice(self.corpus)
+                    j = rng.randrange(len(other))
+                    chunk = other[j:j + len(data) - i]
+                    data[i:i + len(chunk)] = chunk
+                case 5:
+                    length = rng.randrange(1, len(data) - i + 1)
+                    data[i:i + length] = data[i:i + length][::-1]
+
+        return bytes(data)
+
+
+
+'''Running in parallel - one Fuzzer per process, syncing corpus and coverage between rounds'''
+
+_fuzzer = None
+
+
+def _start_worker(target, seed):
+    global _fuzzer
+    _fuzzer = Fuzzer(target, seed + os.getpid())
+
+
+def _fuzz_round(corpus, coverage, seconds):
+    _fuzzer.corpus = list(corpus)
+    _fuzzer.coverage = set(coverage)
+    _fuzzer.crashes = {}
+
+    executions = _fuzzer.executions
+    _fuzzer.fuzz(seconds)
+
+    return _fuzzer.corpus[len(corpus):], _fuzzer.coverage - coverage, _fuzzer.crashes, _fuzzer.executions - executions
+
+
+def run(target, seconds, workers = None, round_seconds = 2, seed = 0, output = None):
+    '''Fuzz target on every core for a number of seconds, printing progress - returns (corpus, coverage, crashes)'''
+
+    workers = workers or os.cpu_count()
+
+    corpus = []
+    coverage = set()
+    crashes = {}
+    executions = 0
+    start = time.perf_counter()
+
+    with multiprocessing.Pool(workers, _start_worker, (target, seed)) as pool:
+        while (elapsed := time.perf_counter() - start) < seconds:
+            results = pool.starmap(_fuzz_round, [(corpus, coverage, min(round_seconds, seconds - elapsed))] * workers)
+
+            for new_entries, new_edges, new_crashes, count in results:
+                corpus += new_entries
+                coverage |= new_edges
+                executions += count
+
+                for key, data in new_crashes.items():
+                    if key not in crashes:
+                        crashes[key] = data
+                        report_crash(key, data, output)
+
+            elapsed = time.perf_counter() - start
+            print(f"{elapsed:7.1f}s  {executions / elapsed:9.0f} execs/s  corpus {len(corpus):5d}  edges {len(coverage):5d}  crashes {len(crashes)}")
+
+    return corpus, coverage, crashes
+
+
+def report_crash(key, data, output):
+    kind, pc = key
+    print(f"\nCrash: {kind} at {pc:04x} - input {data.hex()}")
+
+    if output:
+        os.makedirs(output, exist_ok = True)
+
+        with open(os.path.join(output, f"{kind.replace(' ', '-')}-{pc:04x}.dat"), 'wb') as f:
+            f.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    hex_int = lambda text: int(text, 16)
+
+    parser.add_argument("program", help = "program to load at address 0 (.hex or .bin)")
+    parser.add_argument("--input", type = hex_int, help = "address each test case is written to (hex) - without it, test cases are read from the input port")
+    parser.add_argument("--length", type = int, required = True, help = "test case length in bytes")
+    parser.add_argument("--entry", type = hex_int, help = "run setup code up to this address once, then snapshot (hex)")
+    parser.add_argument("--exit", type = hex_int, help = "an execution ends when PC reaches this address (hex)")
+    parser.add_argument("--budget", type = int, default = 100_000, help = "cycles per execution before it counts as a hang")
+    parser.add_argument("--stack-guard", type = hex_int, nargs = 2, metavar = ("START", "END"), help = "addresses the stack must never write into (hex)")
+    parser.add_argument("--time", type = float, default = 60, help = "seconds to fuzz for")
+    parser.add_argument("--workers", type = int, help = "processes to use (defaults to one per core)")
+    parser.add_argument("--output", help = "directory to save crashing inputs to")
+
+    args = parser.parse_args()
+
+    target = FuzzTarget(args.program, args.input, args.length, args.entry, args.exit, args.budget, args.stack_guard)
+    run(target, args.time, args.workers, output = args.output)
+
+
+if __name__ == '__main__':
+    main()
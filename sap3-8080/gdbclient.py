@@ -0,0 +1,172 @@
+'''Scripted GDB remote protocol client - drives gdbstub.py through a fixed session and checks every reply'''
+
+import socket
+import sys
+import threading
+
+from cpu import CPU
+from gdbstub import GDBStub
+
+'''
+The session's program
+
+0000  21 00 90  LXI H,9000
+0003  36 42     MVI M,42
+0005  3c        INR A
+0006  76        HLT
+'''
+
+PROGRAM = [0x21, 0x00, 0x90, 0x36, 0x42, 0x3C, 0x76]
+
+# (packet sent, reply expected) - None accepts any reply
+SESSION = [
+    ("qSupported:multiprocess+", "PacketSize=4000;QStartNoAckMode+"),
+    ("?", "S05"),
+    ("g", "0200" "0000" "0000" "0000" "0000" "0000"),
+    ("s", "S05"),
+    ("p5", "0300"),
+    ("g", "0200" "0000" "0000" "0090" "0000" "0300"),
+    ("Z2,9000,1", "OK"),
+    ("c", "T05watch:9000;"),
+    ("m9000,1", "42"),
+    ("z2,9000,1", "OK"),
+    ("Z0,6,1", "OK"),
+    ("c", "S05"),
+    ("p5", "0600"),
+    # AF - bits 3 and 5 of the flags always read as 0, and bit 1 as 1
+    ("P0=ff02", "OK"),
+    ("p0", "d702"),
+    ("M9100,2:abcd", "OK"),
+    ("m9100,2", "abcd"),
+    ("mffff,2", "E01"),
+    # malformed packets are rejected, and the session carries on
+    ("mzz,1", "E01"),
+    ("m9000", "E01"),
+    ("M9000,2", "E01"),
+    ("M9000,1:zz", "E01"),
+    ("p", "E01"),
+    ("p-1", "E01"),
+    ("P5", "E01"),
+    ("P5=12", "E01"),
+    ("G0000", "E01"),
+    ("Z0", "E01"),
+    ("z0,0x6,1", "E01"),
+    ("Z0,10000,1", "E01"),
+    ("p5", "0600"),
+    ("z0,6,1", "OK"),
+    ("QStartNoAckMode", "OK"),
+    ("c", "W00"),
+    ("k", "OK"),
+]
+
+
+class RSPClient:
+    '''Minimal remote serial protocol client - sends packets, checks checksums, and handles acks'''
+
+    def __init__(self, port, host = "127.0.0.1"):
+        self.socket = socket.create_connection((host, port))
+        self.received = bytearray()
+        self.ack = True
+
+
+    def command(self, packet):
+        '''Send a packet and return the reply's contents'''
+
+        data = packet.encode("latin-1")
+        self.socket.sendall(b"$" + data + b"#" + f"{sum(data) & 0xFF:02x}".encode("ascii"))
+
+        if self.ack and (ack := self.read(1)) != b"+":
+            raise ValueError(f"Expected an ack for {packet!r}, got {ack!r}")
+
+        reply = self.read_packet()
+
+        if self.ack:
+            self.socket.sendall(b"+")
+
+        if packet == "QStartNoAckMode" and reply == "OK":
+            self.ack = False
+
+        return reply
+
+
+    def read_packet(self):
+        if (start := self.read(1)) != b"$":
+            raise ValueError(f"Expected a packet, got {start!r}")
+
+        data = bytearray()
+
+        while (byte := self.read(1)) != b"#":
+            data += byte
+
+        if int(self.read(2), 16) != sum(data) & 0xFF:
+            raise ValueError(f"Bad checksum on reply {data!r}")
+
+        return data.decode("latin-1")
+
+
+    def read(self, size):
+        while len(self.received) < size:
+            if not (chunk := self.socket.recv(4096)):
+                raise ConnectionError("Stub closed the connection")
+
+            self.received += chunk
+
+        data = bytes(self.received[:size])
+        del self.received[:size]
+
+        return data
+
+
+    def close(self):
+        self.socket.close()
+
+
+
+def check(session = SESSION, program = PROGRAM):
+    '''Run a session against a stub on a free local port - returns a list of failures (empty if it all passed)'''
+
+    cpu = CPU()
+    cpu.reset()
+    cpu.clock.stopped = True
+    cpu.output.display = False
+    cpu.load(program)
+
+    stub = GDBStub(cpu)
+    listening = socket.create_server((stub.host, 0))
+    port = listening.getsockname()[1]
+
+    server = threading.Thread(target = stub.serve, args = (listening,), daemon = True)
+    server.start()
+
+    client = RSPClient(port)
+    failures = []
+
+    try:
+        for packet, expected in session:
+            reply = client.command(packet)
+
+            if expected is not None and reply != expected:
+                failures.append(f"{packet!r}: expected {expected!r}, got {reply!r}")
+
+    finally:
+        client.close()
+        server.join(5)
+
+    if server.is_alive():
+        failures.append("stub didn't finish after the session")
+
+    return failures
+
+
+def main():
+    failures = check()
+
+    for failure in failures:
+        print(failure)
+
+    print(f"{len(SESSION) - len(failures)} / {len(SESSION)} packets OK")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,423 @@
+'''GDB remote serial protocol server - lets GDB (or any RSP client) debug the SAP-3 CPU over a local TCP socket'''
+
+import select
+import socket
+import sys
+import threading
+
+from cpu import CPU
+
+'''
+Registers are exposed as six 16-bit little-endian pairs, in the order AF, BC, DE, HL, SP, PC
+Software (Z0) and hardware (Z1) breakpoints are both handled by the CPU's breakpoints, so guest memory
+is never patched, and write/read/access watchpoints (Z2/Z3/Z4) use the CPU's watchpoints
+'''
+
+SIGINT = 2
+SIGILL = 4
+SIGTRAP = 5
+
+WATCH_KINDS = {"2": "w", "3": "r", "4": "rw"}
+WATCH_NAMES = {"w": "watch", "r": "rwatch", "rw": "awatch"}
+
+
+class GDBStub:
+    def __init__(self, cpu, host = "127.0.0.1", port = 1234):
+        self.cpu = cpu
+        self.host = host
+        self.port = port
+
+        self.client = None
+        self.received = bytearray()
+        self.ack = True
+
+        # (packet type, address) -> CPU breakpoint or watchpoint
+        self.breakpoints = {}
+        self.watchpoints = {}
+
+        self.registers = [
+            (cpu.A, cpu.F),
+            (cpu.B, cpu.C),
+            (cpu.D, cpu.E),
+            (cpu.H, cpu.L),
+            cpu.SP,
+            cpu.PC
+        ]
+
+
+    '''Connection handling'''
+
+
+    def serve(self, listening = None):
+        '''Wait for a single client and handle its packets until it detaches, kills the target, or disconnects'''
+
+        if listening is None:
+            listening = socket.create_server((self.host, self.port))
+
+        with listening:
+            self.port = listening.getsockname()[1]
+            self.client, _ = listening.accept()
+
+        with self.client:
+            self.client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            while (packet := self.read_packet()) is not None:
+                self.send_packet(self.handle(packet))
+
+                if packet == "QStartNoAckMode":
+                    self.ack = False
+
+                if packet[:1] in ("D", "k"):
+                    break
+
+
+    def read_packet(self):
+        '''Return the next packet's contents as a string, or None if the client disconnected'''
+
+        while True:
+            start = self.received.find(b"$")
+            end = self.received.find(b"#", start)
+
+            if start != -1 and end != -1 and len(self.received) >= end + 3:
+                data = bytes(self.received[start + 1:end])
+                checksum = self.received[end + 1:end + 3]
+                del self.received[:end + 3]
+
+                if checksum.lower() != f"{sum(data) & 0xFF:02x}".encode("ascii"):
+                    if self.ack:
+                        self.client.sendall(b"-")
+                    continue
+
+                if self.ack:
+                    self.client.sendall(b"+")
+
+                return unescape(data).decode("latin-1")
+
+            # out of band interrupt or acks while idle - nothing to interrupt, so drop them
+            if start == -1:
+                self.received.clear()
+
+            if not (chunk := self.client.recv(4096)):
+                return None
+
+            self.received += chunk
+
+
+    def send_packet(self, data):
+        data = data.encode("latin-1")
+        self.client.sendall(b"$" + data + b"#" + f"{sum(data) & 0xFF:02x}".encode("ascii"))
+
+        if self.ack:
+            self.wait_for_ack()
+
+
+    def wait_for_ack(self):
+        while not self.received:
+            if not (chunk := self.client.recv(4096)):
+                return
+
+            self.received += chunk
+
+        if self.received[:1] in (b"+", b"-"):
+            del self.received[:1]
+
+
+    '''Packet handling'''
+
+
+    def handle(self, packet):
+        '''Return the reply to a packet - "" for unsupported packets, and E01 for malformed ones'''
+
+        try:
+            return self.dispatch(packet[:1], packet[1:])
+
+        # bad hex, missing fields, or an address out of range - reject the packet rather than drop the connection
+        except (ValueError, IndexError):
+            return "E01"
+
+
+    def dispatch(self, command, args):
+        match command:
+            case "?":
+                return self.stop_reply(SIGTRAP)
+
+            case "g":
+                return "".join(to_hex16(self.read_register(i)) for i in range(len(self.registers)))
+
+            case "G":
+                if len(args) != len(self.registers) * 4:
+                    return "E01"
+
+                values = [from_hex16(args[i * 4:i * 4 + 4]) for i in range(len(self.registers))]
+                for i, value in enumerate(values):
+                    self.write_register(i, value)
+                return "OK"
+
+            case "p":
+                register = from_hex(args)
+                if register >= len(self.registers):
+                    return "E01"
+                return to_hex16(self.read_register(register))
+
+            case "P":
+                register, value = args.split("=")
+                if from_hex(register) >= len(self.registers):
+                    return "E01"
+                self.write_register(from_hex(register), from_hex16(value))
+                return "OK"
+
+            case "m":
+                address, length = (from_hex(x) for x in args.split(","))
+                if address + length > self.cpu.memory.size:
+                    return "E01"
+                return "".join(f"{self.cpu.memory.peek(a):02x}" for a in range(address, address + length))
+
+            case "M" | "X":
+                location, data = args.split(":", 1)
+                address, length = (from_hex(x) for x in location.split(","))
+                data = bytes.fromhex(data) if command == "M" else data.encode("latin-1")
+
+                if len(data) != length or address + length > self.cpu.memory.size:
+                    return "E01"
+
+                for i, byte in enumerate(data):
+                    self.cpu.memory.poke(address + i, byte)
+                return "OK"
+
+            case "s":
+                return self.step()
+
+            case "c":
+                if args:
+                    self.cpu.PC.value = from_hex(args)
+                return self.resume()
+
+            case "Z" | "z":
+                kind, address = args.split(",")[:2]
+                return self.set_breakpoint(command == "Z", kind, address)
+
+            case "q":
+                if args.startswith("Supported"):
+                    return "PacketSize=4000;QStartNoAckMode+"
+                if args == "Attached":
+                    return "1"
+                if args == "C":
+                    return "QC1"
+                if args == "fThreadInfo":
+                    return "m1"
+                if args == "sThreadInfo":
+                    return "l"
+                return ""
+
+            case "Q":
+                if args == "StartNoAckMode":
+                    return "OK"
+                return ""
+
+            case "H" | "T":
+                return "OK"
+
+            case "D" | "k":
+                self.remove_all_breakpoints()
+                return "OK"
+
+            case _:
+                return ""
+
+
+    def read_register(self, index):
+        register = self.registers[index]
+
+        if isinstance(register, tuple):
+            upper, lower = register
+            return upper.value << 8 | lower.value
+
+        return register.value
+
+
+    def write_register(self, index, value):
+        register = self.registers[index]
+
+        if isinstance(register, tuple):
+            upper, lower = register
+            upper.value = value >> 8
+            lower.value = value & 0xFF
+
+        else:
+            register.value = value
+
+
+    '''Execution control'''
+
+
+    def step(self):
+        cpu = self.cpu
+
+        if cpu.halt:
+            return "W00"
+
+        cpu.watch_hit = None
+
+        try:
+            cpu.fetch_instruction()
+            cpu.execute_instruction()
+        except ValueError:
+            return self.stop_reply(SIGILL)
+
+        return self.stop_reply(SIGTRAP)
+
+
+    def resume(self):
+        '''Run until a breakpoint, watchpoint, HLT, invalid opcode, or an interrupt (^C) from the client'''
+
+        cpu = self.cpu
+
+        if cpu.halt:
+            return "W00"
+
+        cpu.watch_hit = None
+        interrupted = []
+        done = threading.Event()
+
+        watcher = threading.Thread(target = self.watch_for_interrupt, args = (done, interrupted), daemon = True)
+        watcher.start()
+
+        try:
+            cpu.run()
+            signal = SIGINT if interrupted else SIGTRAP
+        except ValueError:
+            signal = SIGILL
+        finally:
+            done.set()
+            watcher.join()
+
+        if cpu.halt:
+            return "W00"
+
+        return self.stop_reply(signal)
+
+
+    def watch_for_interrupt(self, done, interrupted):
+        '''Runs alongside cpu.run() - stops the CPU if the client sends ^C'''
+
+        while not done.is_set():
+            readable, _, _ = select.select([self.client], [], [], 0.05)
+
+            if readable and not done.is_set():
+                if not (chunk := self.client.recv(4096)):
+                    self.cpu.stopped = True
+                    return
+
+                if b"\x03" in chunk:
+                    interrupted.append(True)
+                    self.cpu.stopped = True
+
+                self.received += chunk.replace(b"\x03", b"")
+
+
+    def stop_reply(self, signal):
+        self.cpu.output.flush()
+
+        if signal == SIGTRAP and self.cpu.watch_hit:
+            _, address, kind, _ = self.cpu.watch_hit
+
+            for (watch_type, start), watchpoint in self.watchpoints.items():
+                if watchpoint.start <= address <= watchpoint.end and kind in watchpoint.kinds:
+                    return f"T{signal:02x}{WATCH_NAMES[WATCH_KINDS[watch_type]]}:{address:x};"
+
+        return f"S{signal:02x}"
+
+
+    def set_breakpoint(self, insert, kind, address):
+        key = (kind, from_hex(address))
+
+        if kind in ("0", "1"):
+            if insert and key not in self.breakpoints:
+                self.breakpoints[key] = self.cpu.add_breakpoint(key[1])
+            elif not insert and key in self.breakpoints:
+                self.cpu.remove_breakpoint(self.breakpoints.pop(key))
+            return "OK"
+
+        if kind in WATCH_KINDS:
+            if insert and key not in self.watchpoints:
+                self.watchpoints[key] = self.cpu.watch(key[1], kinds = WATCH_KINDS[kind])
+            elif not insert and key in self.watchpoints:
+                self.cpu.unwatch(self.watchpoints.pop(key))
+            return "OK"
+
+        return ""
+
+
+    def remove_all_breakpoints(self):
+        for breakpoint in self.breakpoints.values():
+            self.cpu.remove_breakpoint(breakpoint)
+
+        for watchpoint in self.watchpoints.values():
+            self.cpu.unwatch(watchpoint)
+
+        self.breakpoints.clear()
+        self.watchpoints.clear()
+
+
+
+def to_hex16(value):
+    '''16-bit value as little-endian hex, the byte order RSP uses for registers'''
+
+    return f"{value & 0xFF:02x}{value >> 8:02x}"
+
+
+def from_hex16(text):
+    if len(text) != 4:
+        raise ValueError(f"Invalid 16-bit value: {text!r}")
+
+    return from_hex(text[2:4] + text[0:2])
+
+
+def from_hex(text):
+    '''Parse a hex number - stricter than int(text, 16), which accepts signs, spaces, underscores and 0x'''
+
+    if not text or text.strip("0123456789abcdefABCDEF"):
+        raise ValueError(f"Invalid hex number: {text!r}")
+
+    return int(text, 16)
+
+
+def unescape(data):
+    '''Undo RSP binary escaping ("}" followed by the byte XOR 0x20)'''
+
+    if b"}" not in data:
+        return data
+
+    result = bytearray()
+    escaped = False
+
+    for byte in data:
+        if escaped:
+            result.append(byte ^ 0x20)
+            escaped = False
+        elif byte == ord("}"):
+            escaped = True
+        else:
+            result.append(byte)
+
+    return bytes(result)
+
+
+def main():
+    '''Usage: python gdbstub.py [program file] [port]'''
+
+    cpu = CPU()
+    cpu.reset()
+
+    if len(sys.argv) > 1:
+        cpu.load(sys.argv[1])
+
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 1234
+    stub = GDBStub(cpu, port = port)
+
+    print(f"Waiting for GDB on {stub.host}:{stub.port}")
+    stub.serve()
+
+
+if __name__ == '__main__':
+    main()
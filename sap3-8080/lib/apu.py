@@ -0,0 +1,352 @@
+'''Module for an Am9511-style arithmetic processing unit - integer and floating point maths on an operand stack'''
+
+import math
+
+# status port bits
+BUSY = 0x80
+SIGN = 0x40
+ZERO = 0x20
+CARRY = 0x01
+
+# error codes, in status bits 4 - 1
+DIVIDE_BY_ZERO = 0x10
+NEGATIVE_ARGUMENT = 0x08
+ARGUMENT_TOO_LARGE = 0x18
+UNDERFLOW = 0x04
+OVERFLOW = 0x02
+
+# command bit asking for an interrupt when the command finishes
+SERVICE_REQUEST = 0x80
+
+'''
+Ports, from the unit's base port
+
++0  data - OUT pushes a byte onto the operand stack, IN pops one
++1  command (out) / status (in)
+
+The stack is 16 bytes, circular. Operands are pushed least significant byte first and popped most significant first.
+16-bit (S) and 32-bit (D) integers are two's complement. Floats (F) are the Am9511 format - a sign bit, a 7-bit two's
+complement exponent, and a 24-bit normalized mantissa m (0.5 <= m < 1), for m * 2 ** exponent.
+Two-operand commands work on NOS op TOS (e.g. FSUB is NOS - TOS), popping both and pushing the result.
+
+Commands take cycles from CYCLES (a typical time for each). While one runs, status has BUSY set, and reading
+or writing the data port waits for it to finish, like the real chip holding READY low.
+'''
+
+CYCLES = {
+    "SADD" : 17, "SSUB" : 31, "SMUL" : 89, "SMUU" : 87, "SDIV" : 89,
+    "DADD" : 21, "DSUB" : 38, "DMUL" : 200, "DMUU" : 204, "DDIV" : 200,
+    "FADD" : 200, "FSUB" : 200, "FMUL" : 160, "FDIV" : 160,
+    "SQRT" : 800, "SIN" : 4500, "COS" : 4600, "TAN" : 5500, "ASIN" : 7000, "ACOS" : 7000, "ATAN" : 5000,
+    "LOG" : 5500, "LN" : 5000, "EXP" : 4000, "PWR" : 10000,
+    "FIXS" : 150, "FIXD" : 200, "FLTS" : 100, "FLTD" : 100,
+    "CHSS" : 23, "CHSD" : 27, "CHSF" : 18,
+    "PTOS" : 16, "PTOD" : 20, "PTOF" : 20, "POPS" : 10, "POPD" : 12, "POPF" : 12,
+    "XCHS" : 18, "XCHD" : 26, "XCHF" : 26, "PUPI" : 16, "NOP" : 4,
+}
+
+# command opcode (without the service request bit): name
+COMMANDS = {
+    0x6C : "SADD", 0x6D : "SSUB", 0x6E : "SMUL", 0x76 : "SMUU", 0x6F : "SDIV",
+    0x2C : "DADD", 0x2D : "DSUB", 0x2E : "DMUL", 0x36 : "DMUU", 0x2F : "DDIV",
+    0x10 : "FADD", 0x11 : "FSUB", 0x12 : "FMUL", 0x13 : "FDIV",
+    0x01 : "SQRT", 0x02 : "SIN", 0x03 : "COS", 0x04 : "TAN", 0x05 : "ASIN", 0x06 : "ACOS", 0x07 : "ATAN",
+    0x08 : "LOG", 0x09 : "LN", 0x0A : "EXP", 0x0B : "PWR",
+    0x1F : "FIXS", 0x1E : "FIXD", 0x1D : "FLTS", 0x1C : "FLTD",
+    0x74 : "CHSS", 0x34 : "CHSD", 0x15 : "CHSF",
+    0x77 : "PTOS", 0x37 : "PTOD", 0x17 : "PTOF", 0x78 : "POPS", 0x38 : "POPD", 0x18 : "POPF",
+    0x79 : "XCHS", 0x39 : "XCHD", 0x19 : "XCHF", 0x1A : "PUPI", 0x00 : "NOP",
+}
+
+SIZES = {"S" : 2, "D" : 4, "F" : 4}
+
+
+class ArithmeticUnit:
+    '''
+    Arithmetic processing unit on I/O ports base and base + 1
+
+    Results are computed at host speed as soon as a command is written, but the unit stays busy for the command's
+    cycles (scaled by cycle_scale - 0 makes every command instant), so programs see realistic timings.
+    vector is the RST vector to interrupt with when a command with the service request bit finishes.
+    '''
+
+    def __init__(self, cpu, base_port = 0x50, cycle_scale = 1, vector = None, cycles = None):
+        self.cpu = cpu
+        self.clock = cpu.clock
+        self.scheduler = cpu.scheduler
+        self.base_port = base_port
+        self.cycle_scale = cycle_scale
+        self.vector = vector
+        self.cycles = cycles or CYCLES
+
+        self.stack = bytearray(16)
+        self.top = 0
+
+        self.status = 0
+        self.busy_until = 0
+
+        self.commands = 0
+
+        cpu.io.attach(base_port, self.read_data, self.write_data)
+        cpu.io.attach(base_port + 1, self.read_status, self.command)
+        cpu.devices.append(self)
+
+
+    def save_state(self):
+        return bytes(self.stack), self.top, self.status, self.busy_until
+
+
+    def load_state(self, state):
+        stack, self.top, self.status, self.busy_until = state
+        self.stack[:] = stack
+
+
+    def rebase(self, cycles):
+        '''Keep a running command busy for the same cycles, when the clock's cycle count is reset'''
+
+        self.busy_until = max(self.busy_until - cycles, 0)
+
+
+    '''I/O bus handlers'''
+
+
+    def read_data(self, port):
+        self.wait()
+        self.top = (self.top - 1) & 0xF
+        return self.stack[self.top]
+
+
+    def write_data(self, port, value):
+        self.wait()
+        self.stack[self.top] = value
+        self.top = (self.top + 1) & 0xF
+
+
+    def read_status(self, port):
+        return self.status | (BUSY if self.clock.cycles < self.busy_until else 0)
+
+
+    def command(self, port, value):
+        self.wait()
+
+        if (name := COMMANDS.get(value & ~SERVICE_REQUEST & 0xFF)) is None:
+            return
+
+        self.commands += 1
+        self.status = 0
+        self.execute(name)
+
+        cycles = round(self.cycles[name] * self.cycle_scale)
+        self.busy_until = self.clock.cycles + cycles
+
+        if value & SERVICE_REQUEST and self.vector is not None:
+            if cycles:
+                self.scheduler.schedule(cycles, lambda due: self.cpu.interrupt(self.vector), interrupts = True)
+            else:
+                self.cpu.interrupt(self.vector)
+
+
+    def wait(self):
+        '''Accessing the unit while it's busy stalls the CPU until the command finishes'''
+
+        if self.clock.cycles < self.busy_until:
+            self.clock.pulse(self.busy_until - self.clock.cycles)
+
+
+    '''Operand stack'''
+
+
+    def peek(self, size, depth = 0):
+        '''Unsigned value size bytes wide, depth bytes below the top of the stack'''
+
+        value = 0
+
+        for i in range(1, size + 1):
+            value = value << 8 | self.stack[(self.top - depth - i) & 0xF]
+
+        return value
+
+
+    def pop(self, size):
+        value = self.peek(size)
+        self.top = (self.top - size) & 0xF
+        return value
+
+
+    def push(self, value, size):
+        for _ in range(size):
+            self.stack[self.top] = value & 0xFF
+            self.top = (self.top + 1) & 0xF
+            value >>= 8
+
+
+    def pop_int(self, size):
+        return signed(self.pop(size), size)
+
+
+    def push_int(self, value, size):
+        '''Push a signed result, setting the sign, zero, and overflow bits'''
+
+        bits = size * 8
+
+        if not -(1 << bits - 1) <= value < 1 << bits - 1:
+            self.status |= OVERFLOW
+
+        value &= (1 << bits) - 1
+
+        self.status |= (SIGN if value >> bits - 1 else 0) | (ZERO if value == 0 else 0)
+        self.push(value, size)
+
+
+    def pop_float(self):
+        return from_am9511(self.pop(4))
+
+
+    def push_float(self, value):
+        packed, error = to_am9511(value)
+
+        self.status |= error | (SIGN if packed >> 31 else 0) | (ZERO if packed == 0 else 0)
+        self.push(packed, 4)
+
+
+    '''Commands'''
+
+
+    def execute(self, name):
+        # fixed point arithmetic is sized by its first letter (SADD), conversions and stack commands by their last (FIXS)
+        if name[1:] in ("ADD", "SUB", "MUL", "MUU", "DIV"):
+            size = SIZES[name[0]]
+        else:
+            size = SIZES.get(name[-1], 4)
+
+        match name:
+            case "SADD" | "DADD" | "SSUB" | "DSUB":
+                b, a = self.pop(size), self.pop(size)
+
+                if not 0 <= (a + b if name[1:] == "ADD" else a - b) < 1 << size * 8:
+                    self.status |= CARRY
+
+                a, b = signed(a, size), signed(b, size)
+                self.push_int(a + b if name[1:] == "ADD" else a - b, size)
+
+            case "SMUL" | "DMUL":
+                b, a = self.pop_int(size), self.pop_int(size)
+                # the lower half of the product
+                self.push_int(signed((a * b) & (1 << size * 8) - 1, size), size)
+
+            case "SMUU" | "DMUU":
+                b, a = self.pop_int(size), self.pop_int(size)
+                self.push_int((a * b) >> size * 8, size)
+
+            case "SDIV" | "DDIV":
+                b, a = self.pop_int(size), self.pop_int(size)
+
+                if b == 0:
+                    self.push_int(a, size)
+                    self.status |= DIVIDE_BY_ZERO
+                else:
+                    # rounds toward zero
+                    self.push_int(abs(a) // abs(b) * (1 if (a < 0) == (b < 0) else -1), size)
+
+            case "FADD" | "FSUB" | "FMUL" | "FDIV" | "PWR":
+                b, a = self.pop_float(), self.pop_float()
+
+                if name == "FDIV" and b == 0:
+                    self.push_float(a)
+                    self.status |= DIVIDE_BY_ZERO
+                    return
+
+                operation = {"FADD" : float.__add__, "FSUB" : float.__sub__, "FMUL" : float.__mul__,
+                             "FDIV" : float.__truediv__, "PWR" : math.pow}[name]
+
+                self.float_function(operation, a, b)
+
+            case "SQRT" | "LOG" | "LN":
+                a = self.pop_float()
+
+                if a < 0 or (a == 0 and name != "SQRT"):
+                    self.push_float(a)
+                    self.status |= NEGATIVE_ARGUMENT
+                    return
+
+                self.float_function({"SQRT" : math.sqrt, "LOG" : math.log10, "LN" : math.log}[name], a)
+
+            case "SIN" | "COS" | "TAN" | "ASIN" | "ACOS" | "ATAN" | "EXP":
+                self.float_function(getattr(math, name.lower()), self.pop_float())
+
+            case "FIXS" | "FIXD":
+                value = self.pop_float()
+                self.push_int(int(value), size)
+
+            case "FLTS" | "FLTD":
+                self.push_float(float(self.pop_int(size)))
+
+            case "CHSS" | "CHSD":
+                self.push_int(-self.pop_int(size), size)
+
+            case "CHSF":
+                self.push_float(-self.pop_float())
+
+            case "PTOS" | "PTOD" | "PTOF":
+                self.push(self.peek(size), size)
+
+            case "POPS" | "POPD" | "POPF":
+                self.top = (self.top - size) & 0xF
+
+            case "XCHS" | "XCHD" | "XCHF":
+                b, a = self.pop(size), self.pop(size)
+                self.push(b, size)
+                self.push(a, size)
+
+            case "PUPI":
+                self.push_float(math.pi)
+
+
+    def float_function(self, function, *args):
+        try:
+            self.push_float(function(*args))
+        except (ValueError, OverflowError, ZeroDivisionError):
+            self.push_float(args[-1])
+            self.status |= ARGUMENT_TOO_LARGE
+
+
+
+def signed(value, size):
+    return value - (1 << size * 8) if value >> (size * 8 - 1) else value
+
+
+def from_am9511(packed):
+    if not packed & 0x800000:
+        # no leading mantissa bit - zero
+        return 0.0
+
+    exponent = (packed >> 24) & 0x7F
+    exponent = exponent - 0x80 if exponent & 0x40 else exponent
+
+    value = math.ldexp(packed & 0xFFFFFF, exponent - 24)
+    return -value if packed >> 31 else value
+
+
+def to_am9511(value):
+    '''Returns (packed float, error bits) - out of range values saturate (overflow) or become zero (underflow)'''
+
+    if value == 0 or math.isnan(value):
+        return 0, 0
+
+    mantissa, exponent = math.frexp(abs(value))
+    mantissa = round(mantissa * (1 << 24))
+
+    # rounding up can carry into a 25th bit
+    if mantissa >> 24:
+        mantissa >>= 1
+        exponent += 1
+
+    sign = 1 << 31 if value < 0 else 0
+
+    if exponent > 63:
+        return sign | 0x3F << 24 | 0xFFFFFF, OVERFLOW
+
+    if exponent < -64:
+        return 0, UNDERFLOW
+
+    return sign | (exponent & 0x7F) << 24 | mantissa, 0
@@ -0,0 +1,112 @@
+'''Module for bank-switched memory - windows in the address space onto a larger backing store, switched by I/O ports'''
+
+import mmap
+
+'''
+Ports, from the controller's base port
+
++n  bank selected into window n - OUT switches banks, IN reads back the current one
+
+A window of size bytes at start shows bank b as bytes b * size - (b + 1) * size - 1 of the backing store.
+Bank numbers wrap around at the number of banks that fit in the store.
+'''
+
+
+class Window:
+    '''A window of the address space, start - start + size - 1, showing one bank of the backing store'''
+
+    def __init__(self, memory, store, start, size, bank):
+        self.memory = memory
+        self.store = store
+        self.start = start
+        self.size = size
+        self.banks = len(memory.stores[store]) // size
+
+        self.bank = None
+        self.select(bank)
+
+
+    def select(self, bank):
+        '''Switch banks - only the window's page table entries change, so nothing is copied'''
+
+        self.bank = bank % self.banks
+        self.memory.map_window(self.start, self.start + self.size - 1, self.store, self.bank * self.size)
+
+
+
+class BankedMemory:
+    '''
+    Bank-switched memory on I/O ports base - base + len(windows) - 1
+
+    store is the backing store - a size in bytes (for a new bytearray), a path to an existing file to memory-map,
+    or any writable buffer, like an mmap. windows is a list of (start, size) pairs, each whole pages of memory,
+    and window n starts out showing bank n.
+
+    The store is added to Memory, which resolves the windows itself - registers and instructions don't know about
+    banking at all, while block transfers, debuggers, checkpoints, snapshots, and the state hash see through them.
+    '''
+
+    def __init__(self, cpu, store, windows = ((0x8000, 0x4000),), base_port = 0x70):
+        self.memory = cpu.memory
+        self.base_port = base_port
+        self.file = self.map = None
+
+        if isinstance(store, int):
+            store = bytearray(store)
+
+        elif isinstance(store, str):
+            self.file = open(store, 'r+b')
+            store = self.map = mmap.mmap(self.file.fileno(), 0)
+
+        self.store = memoryview(store)
+        self.store_number = self.memory.add_store(self.store)
+
+        self.windows = []
+
+        for bank, (start, size) in enumerate(windows):
+            if size > len(self.store):
+                raise ValueError(f"Window at {start:04x} is larger than the backing store")
+
+            self.windows.append(Window(self.memory, self.store_number, start, size, bank))
+
+        # totals, for benchmarks
+        self.switches = 0
+
+        cpu.io.attach(range(base_port, base_port + len(self.windows)), self.input, self.output)
+        cpu.devices.append(self)
+
+
+    def save_state(self):
+        # the store's bytes are saved as part of the memory image
+        return [window.bank for window in self.windows]
+
+
+    def load_state(self, state):
+        for window, bank in zip(self.windows, state):
+            window.select(bank)
+
+
+    def input(self, port):
+        return self.windows[port - self.base_port].bank & 0xFF
+
+
+    def output(self, port, value):
+        self.windows[port - self.base_port].select(value)
+        self.switches += 1
+
+
+    def load(self, data, offset = 0):
+        '''Copy data into the backing store, from offset bytes in - bank b of an n-byte window starts at b * n'''
+
+        self.store[offset:offset + len(data)] = data
+        self.memory.rehash()
+
+
+    def close(self):
+        '''Release the store (and close its file) - the CPU can't read the windows after this'''
+
+        self.store.release()
+
+        if self.file:
+            self.map.close()
+            self.file.close()
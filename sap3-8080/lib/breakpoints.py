@@ -0,0 +1,148 @@
+'''Module for conditional breakpoints - conditions are parsed and compiled once, then evaluated only at their address'''
+
+import ast
+
+from lib.registers import PseudoRegister
+
+
+class Breakpoint:
+    '''
+    Breakpoint at address, with an optional condition written as a Python expression
+    e.g. Breakpoint(cpu, condition = "PC == 0x0123 and A > 0x80 and F.zero")
+
+    Conditions can use any register by name (A, B, HL, SP, PC, ...), flags as F.<flag>,
+    and memory as mem[address]. If no address is given, it's taken from a "PC == <address>" term.
+    The CPU only stops once the condition has been true on "after" separate visits.
+    '''
+
+    def __init__(self, cpu, address = None, condition = None, after = 1):
+        self.condition = condition
+        self.code = None
+        self.after = after
+
+        self.hits = 0
+
+        if condition:
+            tree = ast.parse(condition, mode = "eval")
+            check_names(tree, cpu)
+
+            if address is None:
+                address = find_address(tree)
+
+            self.code = compile(tree, f"<breakpoint {condition}>", "eval")
+
+        if address is None:
+            raise ValueError(f"Breakpoint needs an address or a \"PC == <address>\" condition: {condition}")
+
+        if not 0 <= address < cpu.memory.size:
+            raise ValueError(f"Invalid Breakpoint Address: {address:04x}")
+
+        self.address = address
+
+
+    def check(self, scope):
+        '''Count a hit if the condition holds - returns True once there have been enough hits to break'''
+
+        if not self.matches(scope):
+            return False
+
+        self.hits += 1
+
+        return self.hits >= self.after
+
+
+    def matches(self, scope):
+        '''Evaluate the condition without counting a hit'''
+
+        return self.code is None or eval(self.code, {"__builtins__": {}}, scope)
+
+
+    def __str__(self):
+        return f"{self.address:04x}" + (f" if {self.condition}" if self.condition else "")
+
+
+
+class ConditionScope:
+    '''Name lookup for breakpoint conditions - reads the CPU state only for the names a condition uses'''
+
+    def __init__(self, cpu):
+        self.registers = {register.name: register for register in cpu.registers if register.name != "F" and not isinstance(register, PseudoRegister)}
+        self.pointers = {register.name: register for register in cpu.registers if isinstance(register, PseudoRegister)}
+        self.names = {"F": FlagsView(cpu.F), "mem": MemoryView(cpu.memory)}
+
+
+    def __getitem__(self, name):
+        if name in self.registers:
+            return self.registers[name].value
+
+        # M etc. peek like mem[...], rather than reading through watchpoints and I/O handlers
+        if name in self.pointers:
+            register = self.pointers[name]
+            return register.memory.peek(register.pointer_register.value)
+
+        return self.names[name]
+
+
+
+class FlagsView:
+    '''F.zero etc. in conditions, or F.value for the whole register'''
+
+    def __init__(self, flags):
+        self._flags = flags
+
+
+    def __getattr__(self, flag):
+        if flag == "value":
+            return self._flags.value
+
+        try:
+            return self._flags[flag]
+        except KeyError as exc:
+            raise AttributeError(f"Invalid Flag: {flag}") from exc
+
+
+
+class MemoryView:
+    '''mem[address] in conditions - peeks, so conditions never trigger watchpoints'''
+
+    def __init__(self, memory):
+        self._memory = memory
+
+
+    def __getitem__(self, address):
+        return self._memory.peek(address)
+
+
+
+def check_names(tree, cpu):
+    '''Reject conditions that use names the CPU doesn't have'''
+
+    valid_names = {register.name for register in cpu.registers} | {"mem"}
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id not in valid_names:
+            raise ValueError(f"Invalid name in breakpoint condition: {node.id}")
+
+        if isinstance(node, ast.Attribute) and (not isinstance(node.value, ast.Name) or node.value.id != "F"):
+            raise ValueError(f"Invalid attribute in breakpoint condition: {ast.unparse(node)}")
+
+
+def find_address(tree):
+    '''Find the address in a top-level "PC == <address>" term of a condition, or None'''
+
+    body = tree.body
+    terms = body.values if isinstance(body, ast.BoolOp) and isinstance(body.op, ast.And) else [body]
+
+    for term in terms:
+        if not (isinstance(term, ast.Compare) and len(term.ops) == 1 and isinstance(term.ops[0], ast.Eq)):
+            continue
+
+        left, right = term.left, term.comparators[0]
+
+        if isinstance(right, ast.Name):
+            left, right = right, left
+
+        if isinstance(left, ast.Name) and left.id == "PC" and isinstance(right, ast.Constant) and isinstance(right.value, int):
+            return right.value
+
+    return None
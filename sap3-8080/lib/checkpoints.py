@@ -0,0 +1,272 @@
+'''Module for reverse execution - periodic copy-on-write checkpoints of the CPU, replayed forward to reach earlier states'''
+
+import contextlib
+import io
+
+from lib.registers import DoubleRegister, PseudoRegister
+
+
+class Checkpoint:
+    '''
+    CPU state at an instruction boundary
+
+    pages is a full list of immutable memory pages, but any page that didn't change since the
+    previous checkpoint is the previous checkpoint's own bytes object, so only changed pages cost memory
+    machine is the interrupt, scheduler, and device state from cpu.save_state()
+    '''
+
+    def __init__(self, instruction, cycle, registers, halt, pages, new_pages, machine):
+        self.instruction = instruction
+        self.cycle = cycle
+        self.registers = registers
+        self.halt = halt
+        self.pages = pages
+        self.new_pages = new_pages
+        self.machine = machine
+
+
+
+class TimeTravel:
+    '''
+    Runs a CPU while checkpointing it every interval cycles, so it can step backward,
+    reverse continue to a breakpoint, or seek to any cycle since the oldest checkpoint
+
+    Going back restores the nearest earlier checkpoint and silently replays forward from it.
+    Old checkpoints are evicted once the pages they hold go over budget (in bytes).
+    '''
+
+    def __init__(self, cpu, interval = 10_000, budget = 16 * 2**20, page_size = 256):
+        self.cpu = cpu
+        self.memory = cpu.memory
+        self.interval = interval
+        self.budget = budget
+        self.page_size = page_size
+
+        self.registers = [register for register in cpu.registers if not isinstance(register, (DoubleRegister, PseudoRegister))]
+
+        # number of instructions executed since the TimeTravel was created
+        self.instruction = 0
+
+        self.checkpoints = []
+        self.size = 0
+
+        self.checkpoint()
+
+
+    '''Running forward'''
+
+
+    def step(self):
+        '''Execute a single instruction, checkpointing if one is due'''
+
+        self.cpu.fetch_instruction()
+        self.cpu.execute_instruction()
+        self.instruction += 1
+
+        if self.cpu.clock.cycles >= self.next_checkpoint:
+            self.checkpoint()
+
+
+    def run(self):
+        '''Same as cpu.run, but checkpointing as it goes'''
+
+        cpu = self.cpu
+        breakpoints = cpu.breakpoints
+
+        cpu.stopped = False
+
+        if cpu.breakpoint_hit and cpu.breakpoint_hit.address == cpu.PC.value and not cpu.halt:
+            self.step()
+
+        cpu.breakpoint_hit = None
+
+        while not (cpu.halt or cpu.stopped):
+            if cpu.PC.value in breakpoints and cpu.check_breakpoints():
+                break
+
+            self.step()
+
+
+    '''Going back'''
+
+
+    def step_back(self, n = 1):
+        self.replay_to(self.instruction - n)
+
+
+    def reverse_continue(self):
+        '''
+        Go back to the most recent instruction where a breakpoint's condition held
+        Returns False (leaving the CPU at the oldest checkpoint) if there isn't one
+        '''
+
+        cpu = self.cpu
+        breakpoints = cpu.breakpoints
+        end = self.instruction
+
+        for checkpoint in reversed([checkpoint for checkpoint in self.checkpoints if checkpoint.instruction < end]):
+            self.restore(checkpoint)
+            hits = []
+
+            with self.replaying():
+                while self.instruction < end:
+                    if cpu.PC.value in breakpoints:
+                        for breakpoint in breakpoints[cpu.PC.value]:
+                            if breakpoint.matches(cpu.condition_scope):
+                                hits.append((self.instruction, breakpoint))
+
+                    self.replay_step()
+
+            if hits:
+                instruction, cpu.breakpoint_hit = hits[-1]
+                self.replay_to(instruction)
+                return True
+
+            end = checkpoint.instruction
+
+        self.restore(self.checkpoints[0])
+        return False
+
+
+    def seek(self, cycle):
+        '''Move to the first instruction boundary at or after cycle (or the HLT before it)'''
+
+        if cycle < self.cpu.clock.cycles:
+            if cycle < self.checkpoints[0].cycle:
+                self.oldest_error()
+
+            self.restore([checkpoint for checkpoint in self.checkpoints if checkpoint.cycle <= cycle][-1])
+
+            with self.replaying():
+                while self.cpu.clock.cycles < cycle and not self.cpu.halt:
+                    self.replay_step()
+
+        else:
+            while self.cpu.clock.cycles < cycle and not self.cpu.halt:
+                self.step()
+
+
+    def replay_to(self, instruction):
+        '''Restore the nearest checkpoint at or before instruction, then replay up to it'''
+
+        if instruction < self.checkpoints[0].instruction:
+            self.oldest_error()
+
+        self.restore([checkpoint for checkpoint in self.checkpoints if checkpoint.instruction <= instruction][-1])
+
+        with self.replaying():
+            while self.instruction < instruction:
+                self.replay_step()
+
+
+    def replay_step(self):
+        self.cpu.fetch_instruction()
+        self.cpu.execute_instruction()
+        self.instruction += 1
+
+
+    @contextlib.contextmanager
+    def replaying(self):
+        '''Replay at full speed, without output or watchpoints'''
+
+        memory = self.memory
+        clock = self.cpu.clock
+        output = self.cpu.output
+        watched = memory.watched
+        display = output.display
+
+        # values output again by the replay were written and captured the first time round
+        captured = len(output.captured) if output.captured is not None else None
+
+        memory.watched = [None] * len(watched)
+        clock.stopped = True
+        output.flush()
+
+        # muting the sink itself covers a file-backed sink, which redirecting stdout doesn't
+        output.display = False
+
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                yield
+
+        finally:
+            output.display = display
+            output.discard(captured)
+            memory.watched = watched
+            clock.stopped = self.cpu.halt
+
+
+    def oldest_error(self):
+        raise ValueError(f"Can't go back past the oldest checkpoint (cycle {self.checkpoints[0].cycle})")
+
+
+    '''Checkpoints'''
+
+
+    def checkpoint(self):
+        page_size = self.page_size
+
+        previous = self.checkpoints[-1].pages if self.checkpoints else None
+
+        pages = []
+        new_pages = 0
+
+        for i, page in enumerate(self.memory.image_pages(page_size)):
+            if previous and i < len(previous) and page == previous[i]:
+                page = previous[i]
+            else:
+                new_pages += 1
+
+            pages.append(page)
+
+        self.checkpoints.append(Checkpoint(
+            self.instruction,
+            self.cpu.clock.cycles,
+            [register.value for register in self.registers],
+            self.cpu.halt,
+            pages,
+            new_pages,
+            self.cpu.save_state()
+        ))
+
+        self.size += new_pages * page_size
+        self.next_checkpoint = self.cpu.clock.cycles + self.interval
+
+        while self.size > self.budget and len(self.checkpoints) > 1:
+            self.evict()
+
+
+    def evict(self):
+        '''Drop the oldest checkpoint - the next one takes over any pages they shared'''
+
+        oldest, following = self.checkpoints[0], self.checkpoints[1]
+
+        shared = sum(1 for a, b in zip(oldest.pages, following.pages) if a is b)
+        following.new_pages += shared
+
+        self.size -= (oldest.new_pages - shared) * self.page_size
+        del self.checkpoints[0]
+
+
+    def restore(self, checkpoint):
+        '''Put the CPU back in a checkpoint's state - later checkpoints are dropped, and retaken as it runs forward again'''
+
+        cpu = self.cpu
+
+        for register, value in zip(self.registers, checkpoint.registers):
+            register.value = value
+
+        cpu.halt = checkpoint.halt
+        cpu.stopped = False
+        cpu.clock.cycles = checkpoint.cycle
+        cpu.clock.stopped = checkpoint.halt
+        cpu.load_state(checkpoint.machine)
+
+        self.memory.restore(b''.join(checkpoint.pages))
+        self.instruction = checkpoint.instruction
+
+        while self.checkpoints[-1] is not checkpoint:
+            dropped = self.checkpoints.pop()
+            self.size -= dropped.new_pages * self.page_size
+
+        self.next_checkpoint = checkpoint.cycle + self.interval
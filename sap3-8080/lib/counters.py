@@ -0,0 +1,108 @@
+'''Module for guest-readable timing ports - the cycle counter, host time, and benchmark markers'''
+
+import collections
+import time
+
+'''
+Ports, from the device's base port
+
++0        latch (out) - copies the cycle counter and host clocks, so multi-byte values read consistently
++0 - +3   latched cycle count, least significant byte first (in)
++4 - +7   latched host milliseconds since the device was created, least significant byte first (in)
++8 - +A   latched local time - seconds, minutes, hours (in)
++B        benchmark marker (out) - records the value written with the current cycle count and host time
+'''
+
+
+class Marker:
+    '''A marker OUT - the value written, and the cycle count and host time (perf_counter) it was written at'''
+
+    def __init__(self, value, cycle, host_time):
+        self.value = value
+        self.cycle = cycle
+        self.host_time = host_time
+
+
+
+class TimingPorts:
+    '''
+    Cycle counter, real-time clock, and benchmark markers on I/O ports base - base + 11
+
+    Guest code times itself by latching and reading the counters, or just by writing markers around the code
+    it wants measured - nothing is recorded anywhere else, so only the marker OUTs cost anything.
+    The markers are collected afterward from self.markers, or summed up by region with regions().
+    '''
+
+    def __init__(self, cpu, base_port = 0x60):
+        self.clock = cpu.clock
+        self.base_port = base_port
+
+        self.start_time = time.perf_counter()
+        self.latched = bytes(11)
+
+        self.markers = []
+
+        cpu.io.attach(range(base_port, base_port + 11), self.input)
+        cpu.io.attach(base_port, output = self.latch)
+        cpu.io.attach(base_port + 11, output = self.mark)
+        cpu.devices.append(self)
+
+
+    def save_state(self):
+        # markers recorded after a checkpoint are dropped when going back to it, so replays don't record them twice
+        return self.latched, len(self.markers)
+
+
+    def load_state(self, state):
+        self.latched, markers = state
+        del self.markers[markers:]
+
+
+    def rebase(self, cycles):
+        '''Shift the markers' cycle counts back by cycles, so regions spanning a reset of the clock still add up'''
+
+        for marker in self.markers:
+            marker.cycle -= cycles
+
+
+    def input(self, port):
+        return self.latched[port - self.base_port]
+
+
+    def latch(self, port = None, value = None):
+        milliseconds = int((time.perf_counter() - self.start_time) * 1000)
+        now = time.localtime()
+
+        self.latched = (
+            (self.clock.cycles & 0xFFFF_FFFF).to_bytes(4, "little")
+            + (milliseconds & 0xFFFF_FFFF).to_bytes(4, "little")
+            + bytes((now.tm_sec, now.tm_min, now.tm_hour))
+        )
+
+
+    def mark(self, port, value):
+        self.markers.append(Marker(value, self.clock.cycles, time.perf_counter()))
+
+
+    def regions(self):
+        '''
+        Cycles spent between each pair of consecutive markers, keyed by (first marker value, second marker value)
+        Returns {(from, to): (times seen, total cycles, total host seconds)}
+        '''
+
+        regions = collections.defaultdict(lambda: [0, 0, 0.0])
+
+        for first, second in zip(self.markers, self.markers[1:]):
+            region = regions[first.value, second.value]
+            region[0] += 1
+            region[1] += second.cycle - first.cycle
+            region[2] += second.host_time - first.host_time
+
+        return {key: tuple(region) for key, region in regions.items()}
+
+
+    def print_regions(self):
+        print(f"\n{'region':9}  {'count':>7}  {'cycles':>12}  {'cycles each':>11}  {'host ms':>9}")
+
+        for (first, second), (count, cycles, seconds) in sorted(self.regions().items()):
+            print(f"{first:02x} -> {second:02x}  {count:7}  {cycles:12}  {cycles / count:11.1f}  {seconds * 1000:9.2f}")
@@ -0,0 +1,167 @@
+'''Module for a simple disk controller - sector reads and writes between a memory-mapped disk image and memory'''
+
+import mmap
+import os
+
+# an 8" single density floppy, as used by CP/M
+SECTOR_SIZE = 128
+SECTORS_PER_TRACK = 26
+TRACKS = 77
+
+# what a freshly formatted CP/M disk is filled with
+FORMAT_BYTE = 0xE5
+
+# commands
+READ = 1
+WRITE = 2
+
+# status
+OK = 0
+ERROR = 1
+
+'''
+Ports, from the controller's base port
+
++0  track (out)
++1  sector (out) - numbered from 1, like CP/M
++2  transfer address low byte (out)
++3  transfer address high byte (out)
++4  sector count (out) - transfers continue onto the following sectors and tracks
++5  command (out) / status of the last command (in)
+'''
+
+
+class DiskController:
+    '''
+    Disk controller on I/O ports base - base + 5, for one disk image file
+
+    The image is memory-mapped, so a transfer is a single slice copy between the file's pages and memory
+    (no reads, writes, or intermediate buffers), however many sectors it covers.
+    A missing image is created, formatted. The CPU isn't charged any cycles for transfers.
+    '''
+
+    def __init__(self, cpu, image, base_port = 0x08, sector_size = SECTOR_SIZE, sectors_per_track = SECTORS_PER_TRACK, tracks = TRACKS):
+        self.memory = cpu.memory
+        self.base_port = base_port
+
+        self.sector_size = sector_size
+        self.sectors_per_track = sectors_per_track
+        self.tracks = tracks
+        self.size = sector_size * sectors_per_track * tracks
+
+        if not os.path.exists(image):
+            with open(image, 'wb') as f:
+                f.write(bytes([FORMAT_BYTE]) * self.size)
+
+        elif os.path.getsize(image) < self.size:
+            with open(image, 'ab') as f:
+                f.write(bytes([FORMAT_BYTE]) * (self.size - os.path.getsize(image)))
+
+        self.file = open(image, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), self.size)
+
+        self.track = 0
+        self.sector = 1
+        self.address = 0
+        self.count = 1
+        self.status = OK
+
+        # totals, for benchmarks
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+        cpu.io.attach(range(base_port, base_port + 6), self.input, self.output)
+        cpu.devices.append(self)
+
+
+    def save_state(self):
+        # just the controller's registers - the image isn't part of the saved state
+        return self.track, self.sector, self.address, self.count, self.status
+
+
+    def load_state(self, state):
+        self.track, self.sector, self.address, self.count, self.status = state
+
+
+    def input(self, port):
+        return self.status if port == self.base_port + 5 else 0xFF
+
+
+    def output(self, port, value):
+        match port - self.base_port:
+            case 0:
+                self.track = value
+            case 1:
+                self.sector = value
+            case 2:
+                self.address = (self.address & 0xFF00) | value
+            case 3:
+                self.address = (self.address & 0x00FF) | value << 8
+            case 4:
+                self.count = value
+            case 5:
+                self.command(value)
+
+
+    def command(self, command):
+        if command == READ:
+            self.status = self.read(self.track, self.sector, self.address, self.count)
+        elif command == WRITE:
+            self.status = self.write(self.track, self.sector, self.address, self.count)
+        else:
+            self.status = ERROR
+
+
+    def offset(self, track, sector, count):
+        '''Image offset and length of a transfer, or None if it runs off the disk or memory'''
+
+        if not (track < self.tracks and 1 <= sector <= self.sectors_per_track and count):
+            return None
+
+        offset = (track * self.sectors_per_track + sector - 1) * self.sector_size
+        length = count * self.sector_size
+
+        if offset + length > self.size:
+            return None
+
+        return offset, length
+
+
+    def read(self, track, sector, address, count = 1):
+        '''Disk to memory'''
+
+        if (transfer := self.offset(track, sector, count)) is None or address + transfer[1] > self.memory.size:
+            return ERROR
+
+        offset, length = transfer
+
+        with memoryview(self.map) as view:
+            self.memory.copy_in(address, view[offset:offset + length])
+
+        self.bytes_read += length
+        return OK
+
+
+    def write(self, track, sector, address, count = 1):
+        '''Memory to disk'''
+
+        if (transfer := self.offset(track, sector, count)) is None or address + transfer[1] > self.memory.size:
+            return ERROR
+
+        offset, length = transfer
+
+        with self.memory.view(address, length) as view:
+            self.map[offset:offset + length] = view
+
+        self.bytes_written += length
+        return OK
+
+
+    def flush(self):
+        self.map.flush()
+
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
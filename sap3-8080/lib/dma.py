@@ -0,0 +1,119 @@
+'''Module for a DMA controller - memory to memory copies and fills, done as single slice operations'''
+
+# control port bits
+START = 0x01
+FILL = 0x02
+INTERRUPT = 0x04
+
+# status port bits
+ERROR = 0x02
+
+'''
+Ports, from the controller's base port
+
++0, +1  source address (low, high)
++2, +3  destination address (low, high)
++4, +5  length in bytes (low, high)
++6      fill byte
++7      control (out) - START begins a transfer, FILL fills instead of copying, INTERRUPT interrupts when done
+        status (in) - ERROR if the last transfer ran off the end of memory (nothing is transferred then)
+
+Overlapping copies behave like memmove - the destination ends up with the source's original bytes.
+'''
+
+
+class DMAController:
+    '''
+    Memory to memory DMA on I/O ports base - base + 7
+
+    A whole transfer is one slice copy (or fill) on Memory, however long. With cycles_per_byte, the CPU is charged
+    that many cycles per byte, as if it was held off the bus for the transfer - otherwise transfers are free.
+    vector is the RST vector to interrupt with when a transfer with the INTERRUPT bit set finishes.
+    '''
+
+    def __init__(self, cpu, base_port = 0x20, cycles_per_byte = 0, vector = None):
+        self.cpu = cpu
+        self.memory = cpu.memory
+        self.base_port = base_port
+        self.cycles_per_byte = cycles_per_byte
+        self.vector = vector
+
+        # 16-bit registers, written a byte at a time
+        self.registers = [0, 0, 0]
+        self.fill_byte = 0
+        self.status = 0
+
+        # totals, for benchmarks
+        self.transfers = 0
+        self.bytes_transferred = 0
+
+        cpu.io.attach(range(base_port, base_port + 8), self.input, self.output)
+        cpu.devices.append(self)
+
+
+    def save_state(self):
+        return list(self.registers), self.fill_byte, self.status
+
+
+    def load_state(self, state):
+        registers, self.fill_byte, self.status = state
+        self.registers = list(registers)
+
+
+    def input(self, port):
+        offset = port - self.base_port
+
+        if offset < 6:
+            register = self.registers[offset >> 1]
+            return register >> 8 if offset & 1 else register & 0xFF
+
+        return self.fill_byte if offset == 6 else self.status
+
+
+    def output(self, port, value):
+        offset = port - self.base_port
+
+        if offset < 6:
+            register = self.registers[offset >> 1]
+            self.registers[offset >> 1] = (register & 0x00FF) | value << 8 if offset & 1 else (register & 0xFF00) | value
+
+        elif offset == 6:
+            self.fill_byte = value
+
+        elif value & START:
+            source, destination, length = self.registers
+
+            if value & FILL:
+                self.status = self.fill(destination, length, self.fill_byte)
+            else:
+                self.status = self.copy(source, destination, length)
+
+            if value & INTERRUPT and self.vector is not None:
+                self.cpu.interrupt(self.vector)
+
+
+    def copy(self, source, destination, length):
+        if max(source, destination) + length > self.memory.size:
+            return ERROR
+
+        # a copy of the source first, in case it overlaps the destination
+        self.memory.copy_in(destination, bytes(self.memory.view(source, length)))
+        return self.transferred(length)
+
+
+    def fill(self, destination, length, value):
+        if destination + length > self.memory.size:
+            return ERROR
+
+        self.memory.copy_in(destination, bytes((value,)) * length)
+        return self.transferred(length)
+
+
+    def transferred(self, length):
+        self.transfers += 1
+        self.bytes_transferred += length
+
+        if self.cycles_per_byte:
+            self.cpu.clock.pulse(length * self.cycles_per_byte)
+
+        return 0
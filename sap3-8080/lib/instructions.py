@@ -1,15 +1,30 @@
 '''Module for storing CPU instruction methods and instruction decoding table'''
 
+# auxiliary carry helpers - set the aux flag from A and the other operand, before A is updated
+
+def add_aux(cpu, value, carry = 0):
+    cpu.F["aux"] = (cpu.A.value & 0x0F) + (value & 0x0F) + carry > 0x0F
+
+def sub_aux(cpu, value, borrow = 0):
+    # the 8080 subtracts by adding the complement, so aux is the carry out of bit 3 of that addition
+    cpu.F["aux"] = (cpu.A.value & 0x0F) + (~value & 0x0F) + (not borrow) > 0x0F
+
+def and_aux(cpu, value):
+    cpu.F["aux"] = (cpu.A.value | value) & 0x08 != 0
+
+
 # instruction methods
 
 def ACI(cpu):
     cpu.fetch_byte()
+    add_aux(cpu, cpu.Z.value, cpu.F["carry"])
     cpu.A.value += cpu.Z.value + cpu.F["carry"]
     cpu.update_flags()
     cpu.clock.pulse(7)
 
 
 def ADC(cpu, register):
+    add_aux(cpu, register.value, cpu.F["carry"])
     cpu.A.value += register.value + cpu.F["carry"]
     cpu.update_flags()
     cpu.clock.pulse(4)
@@ -36,12 +51,14 @@ def ADCL(cpu):
     ADC(cpu, cpu.L)
 
 def ADCM(cpu):
+    add_aux(cpu, cpu.M.value, cpu.F["carry"])
     cpu.A.value += cpu.M.value + cpu.F["carry"]
     cpu.update_flags()
     cpu.clock.pulse(7)
 
 
 def ADD(cpu, register):
+    add_aux(cpu, register.value)
     cpu.A.add(register)
     cpu.update_flags()
     cpu.clock.pulse(4)
@@ -68,6 +85,7 @@ def ADDL(cpu):
     ADD(cpu, cpu.L)
 
 def ADDM(cpu):
+    add_aux(cpu, cpu.M.value)
     cpu.A.add(cpu.M)
     cpu.update_flags()
     cpu.clock.pulse(7)
@@ -75,12 +93,14 @@ def ADDM(cpu):
 
 def ADI(cpu):
     cpu.fetch_byte()
+    add_aux(cpu, cpu.Z.value)
     cpu.A.add(cpu.Z)
     cpu.update_flags()
     cpu.clock.pulse(7)
 
 
 def ANA(cpu, register):
+    and_aux(cpu, register.value)
     cpu.A.and_reg(register)
     cpu.update_flags()
     cpu.clock.pulse(4)
@@ -107,6 +127,7 @@ def ANAL(cpu):
     ANA(cpu, cpu.L)
 
 def ANAM(cpu):
+    and_aux(cpu, cpu.M.value)
     cpu.A.and_reg(cpu.M)
     cpu.update_flags()
     cpu.clock.pulse(7)
@@ -114,6 +135,7 @@ def ANAM(cpu):
 
 def ANI(cpu):
     cpu.fetch_byte()
+    and_aux(cpu, cpu.Z.value)
     cpu.A.and_reg(cpu.Z)
     cpu.update_flags()
     cpu.clock.pulse(7)
@@ -157,6 +179,7 @@ def CMC(cpu):
 
 
 def CMP(cpu, register):
+    sub_aux(cpu, register.value)
     cpu.A.transfer_to(cpu.W)
     cpu.W.sub(register)
     cpu.update_flags(cpu.W)
@@ -184,6 +207,7 @@ def CMPL(cpu):
     CMP(cpu, cpu.L)
 
 def CMPM(cpu):
+    sub_aux(cpu, cpu.M.value)
     cpu.A.transfer_to(cpu.W)
     cpu.W.sub(cpu.M)
     cpu.update_flags(cpu.W)
@@ -224,6 +248,7 @@ def CPE(cpu):
 
 def CPI(cpu):
     cpu.fetch_byte()
+    sub_aux(cpu, cpu.Z.value)
     cpu.A.transfer_to(cpu.W)
     cpu.W.sub(cpu.Z)
     cpu.update_flags(cpu.W)
@@ -246,6 +271,24 @@ def CZ(cpu):
         cpu.clock.pulse(9)
 
 
+def DAA(cpu):
+    correction = 0
+    carry = cpu.F["carry"]
+
+    if cpu.A.value & 0x0F > 9 or cpu.F["aux"]:
+        correction |= 0x06
+
+    if cpu.A.value > 0x99 or carry:
+        correction |= 0x60
+        carry = 1
+
+    add_aux(cpu, correction)
+    cpu.A.value += correction
+    cpu.update_flags(cpu.A, "abc")
+    cpu.F["carry"] = carry
+    cpu.clock.pulse(4)
+
+
 def DAD(cpu, register):
     cpu.HL.add(register)
     cpu.update_flags(cpu.H, "carry")
@@ -267,6 +310,7 @@ def DADSP(cpu):
 def DCR(cpu, register):
     register.dec()
     cpu.update_flags(register, "abc")
+    cpu.F["aux"] = register.value & 0x0F != 0x0F
     cpu.clock.pulse(4)
 
 def DCRA(cpu):
@@ -293,6 +337,7 @@ def DCRL(cpu):
 def DCRM(cpu):
     cpu.M.dec()
     cpu.update_flags(cpu.M, "abc")
+    cpu.F["aux"] = cpu.M.value & 0x0F != 0x0F
     cpu.clock.pulse(10)
 
 
@@ -313,15 +358,39 @@ def DCXSP(cpu):
     DCX(cpu, cpu.SP)
 
 
+def DI(cpu):
+    cpu.disable_interrupts()
+    cpu.clock.pulse(4)
+
+
+def EI(cpu):
+    cpu.clock.pulse(4)
+    cpu.enable_interrupts()
+
+
 def HLT(cpu):
-    cpu.halt = True
     cpu.clock.pulse(5)
+
+    # with interrupts enabled and a device that can still interrupt, wait for it instead of stopping
+    if cpu.interrupts_enabled and cpu.can_be_interrupted():
+        cpu.wait_for_interrupt()
+        return
+
+    cpu.halt = True
     cpu.clock.stop()
     
     
+def IN(cpu):
+    cpu.fetch_byte() # port number
+    cpu.IN.value = cpu.io.inputs[cpu.Z.value](cpu.Z.value)
+    cpu.A.transfer_from(cpu.IN)
+    cpu.clock.pulse(10)
+
+
 def INR(cpu, register):
     register.inc()
     cpu.update_flags(register, "abc")
+    cpu.F["aux"] = register.value & 0x0F == 0
     cpu.clock.pulse(4)
 
 def INRA(cpu):
@@ -348,6 +417,7 @@ def INRL(cpu):
 def INRM(cpu):
     cpu.M.inc()
     cpu.update_flags(cpu.M, "abc")
+    cpu.F["aux"] = cpu.M.value & 0x0F == 0
     cpu.clock.pulse(10)
 
 
@@ -726,6 +796,7 @@ def NOP(cpu):
 
 
 def ORA(cpu, register):
+    cpu.F["aux"] = 0
     cpu.A.or_reg(register)
     cpu.update_flags()
     cpu.clock.pulse(4)
@@ -752,6 +823,7 @@ def ORAL(cpu):
     ORA(cpu, cpu.L)
 
 def ORAM(cpu):
+    cpu.F["aux"] = 0
     cpu.A.or_reg(cpu.M)
     cpu.update_flags()
     cpu.clock.pulse(7)
@@ -759,15 +831,16 @@ def ORAM(cpu):
 
 def ORI(cpu):
     cpu.fetch_byte()
+    cpu.F["aux"] = 0
     cpu.A.or_reg(cpu.Z)
     cpu.update_flags()
     cpu.clock.pulse(7)
 
 
 def OUT(cpu):
-    cpu.PC.inc()
+    cpu.fetch_byte() # port number
     cpu.OUT.transfer_from(cpu.A)
-    print(f"\n{cpu.OUT.value:08b} {cpu.OUT.value:02x}")
+    cpu.io.outputs[cpu.Z.value](cpu.Z.value, cpu.OUT.value)
     cpu.clock.pulse(10)
 
 
@@ -797,9 +870,9 @@ def POPPSW(cpu):
 
 
 def PUSH(cpu, upper_register, lower_register):
-    cpu.sp.dec()
+    cpu.SP.dec()
     upper_register.store(cpu.memory, cpu.SP.value)
-    cpu.sp.dec()
+    cpu.SP.dec()
     lower_register.store(cpu.memory, cpu.SP.value)
     cpu.clock.pulse(12)
 
@@ -902,37 +975,38 @@ def RRC(cpu):
     cpu.clock.pulse(4)
 
 
+def RST(cpu, vector):
+    cpu.SP.dec()
+    cpu.memory[cpu.SP.value] = cpu.PC.msb(8)
+    cpu.SP.dec()
+    cpu.memory[cpu.SP.value] = cpu.PC.lsb(8)
+
+    cpu.PC.value = vector << 3
+    cpu.clock.pulse(11)
+
 def RST0(cpu):
-    cpu.PC.value = 0x0000
-    cpu.clock.pulse(12)
+    RST(cpu, 0)
 
 def RST1(cpu):
-    cpu.PC.value = 0x0008
-    cpu.clock.pulse(12)
+    RST(cpu, 1)
 
 def RST2(cpu):
-    cpu.PC.value = 0x0010
-    cpu.clock.pulse(12)
+    RST(cpu, 2)
 
 def RST3(cpu):
-    cpu.PC.value = 0x00018
-    cpu.clock.pulse(12)
+    RST(cpu, 3)
 
 def RST4(cpu):
-    cpu.PC.value = 0x0020
-    cpu.clock.pulse(12)
+    RST(cpu, 4)
 
 def RST5(cpu):
-    cpu.PC.value = 0x0028
-    cpu.clock.pulse(12)
+    RST(cpu, 5)
 
 def RST6(cpu):
-    cpu.PC.value = 0x0030
-    cpu.clock.pulse(12)
+    RST(cpu, 6)
 
 def RST7(cpu):
-    cpu.PC.value = 0x0038
-    cpu.clock.pulse(12)
+    RST(cpu, 7)
 
 
 def RZ(cpu):
@@ -943,6 +1017,7 @@ def RZ(cpu):
 
 
 def SBB(cpu, register):
+    sub_aux(cpu, register.value, cpu.F["carry"])
     cpu.A.value -= register.value + cpu.F["carry"]
     cpu.update_flags()
     cpu.clock.pulse(4)
@@ -969,6 +1044,7 @@ def SBBL(cpu):
     SBB(cpu, cpu.L)
 
 def SBBM(cpu):
+    sub_aux(cpu, cpu.M.value, cpu.F["carry"])
     cpu.A.value -= cpu.M.value + cpu.F["carry"]
     cpu.update_flags()
     cpu.clock.pulse(7)
@@ -976,6 +1052,7 @@ def SBBM(cpu):
 
 def SBI(cpu):
     cpu.fetch_byte()
+    sub_aux(cpu, cpu.Z.value, cpu.F["carry"])
     cpu.A.value -= cpu.Z.value + cpu.F["carry"]
     cpu.update_flags()
     cpu.clock.pulse(7)
@@ -1017,6 +1094,7 @@ def STC(cpu):
 
 
 def SUB(cpu, register):
+    sub_aux(cpu, register.value)
     cpu.A.sub(register)
     cpu.update_flags()
     cpu.clock.pulse(4)
@@ -1043,6 +1121,7 @@ def SUBL(cpu):
     SUB(cpu, cpu.L)
 
 def SUBM(cpu):
+    sub_aux(cpu, cpu.M.value)
     cpu.A.sub(cpu.M)
     cpu.update_flags()
     cpu.clock.pulse(7)
@@ -1050,6 +1129,7 @@ def SUBM(cpu):
 
 def SUI(cpu):
     cpu.fetch_byte()
+    sub_aux(cpu, cpu.Z.value)
     cpu.A.sub(cpu.Z)
     cpu.update_flags()
     cpu.clock.pulse(7)
@@ -1061,6 +1141,7 @@ def XCHG(cpu):
 
 
 def XRA(cpu, register):
+    cpu.F["aux"] = 0
     cpu.A.xor_reg(register)
     cpu.update_flags()
     cpu.clock.pulse(4)
@@ -1087,6 +1168,7 @@ def XRAL(cpu):
     XRA(cpu, cpu.L)
 
 def XRAM(cpu):
+    cpu.F["aux"] = 0
     cpu.A.xor_reg(cpu.M)
     cpu.update_flags()
     cpu.clock.pulse(7)
@@ -1094,6 +1176,7 @@ def XRAM(cpu):
 
 def XRI(cpu):
     cpu.fetch_byte()
+    cpu.F["aux"] = 0
     cpu.A.xor_reg(cpu.Z)
     cpu.update_flags()
     cpu.clock.pulse(7)
@@ -1132,7 +1215,8 @@ instruction_table = {
     0x17 : RAL,
     0x19 : DADD,
     0x1A : LDAXD,
-    0x1B : INRE,
+    0x1B : DCXD,
+    0x1C : INRE,
     0x1D : DCRE,
     0x1E : MVIE,
     0x1F : RAR,
@@ -1142,6 +1226,7 @@ instruction_table = {
     0x24 : INRH,
     0x25 : DCRH,
     0x26 : MVIH,
+    0x27 : DAA,
     0x29 : DADH,
     0x2A : LHLD,
     0x2B : DCXH,
@@ -1154,7 +1239,7 @@ instruction_table = {
     0x33 : INXSP,
     0x34 : INRM,
     0x35 : DCRM,
-    0x36 : DCRM,
+    0x36 : MVIM,
     0x37 : STC,
     0x39 : DADSP,
     0x3A : LDA,
@@ -1316,6 +1401,7 @@ instruction_table = {
     0xD7 : RST2,
     0xD8 : RC,
     0xDA : JC,
+    0xDB : IN,
     0xDC : CC,
     0xDE : SBI,
     0xDF : RST3,
@@ -1337,6 +1423,7 @@ instruction_table = {
     0xF0 : RP,
     0xF1 : POPPSW,
     0xF2 : JP,
+    0xF3 : DI,
     0xF4 : CP,
     0xF5 : PUSHPSW,
     0xF6 : ORI,
@@ -1344,6 +1431,7 @@ instruction_table = {
     0xF8 : RM,
     0xF9 : SPHL,
     0xFA : JM,
+    0xFB : EI,
     0xFC : CM,
     0xFE : CPI,
     0xFF : RST7
@@ -0,0 +1,68 @@
+'''Module for the I/O bus - 256 input and 256 output ports, each dispatched to a device's handler'''
+
+
+class IOBus:
+    '''
+    Port-indexed handler tables for the IN and OUT instructions
+
+    inputs[port](port) returns the byte read, and outputs[port](port, value) takes the byte written.
+    Every port always has a handler - unmapped ports use the defaults - so IN and OUT are a single indexed call.
+    '''
+
+    def __init__(self, default_input = None, default_output = None):
+        self.default_input = default_input or unmapped_input
+        self.default_output = default_output or unmapped_output
+
+        self.inputs = [self.default_input] * 256
+        self.outputs = [self.default_output] * 256
+
+        # port: device, for listing what's attached
+        self.devices = {}
+
+
+    def attach(self, ports, input = None, output = None, device = None):
+        '''Map a port (or range of ports) to handlers - either can be None to leave that direction as it is'''
+
+        for port in ports_of(ports):
+            if input:
+                self.inputs[port] = input
+            if output:
+                self.outputs[port] = output
+
+            self.devices[port] = device or getattr(input or output, "__self__", None)
+
+
+    def detach(self, ports):
+        '''Return ports to the defaults'''
+
+        for port in ports_of(ports):
+            self.inputs[port] = self.default_input
+            self.outputs[port] = self.default_output
+            self.devices.pop(port, None)
+
+
+    def read(self, port):
+        return self.inputs[port](port)
+
+
+    def write(self, port, value):
+        self.outputs[port](port, value)
+
+
+
+def ports_of(ports):
+    ports = range(ports, ports + 1) if isinstance(ports, int) else ports
+
+    if not all(0 <= port <= 0xFF for port in ports):
+        raise ValueError(f"Invalid port(s): {ports}")
+
+    return ports
+
+
+def unmapped_input(port):
+    # nothing drives the data bus, so it floats high
+    return 0xFF
+
+
+def unmapped_output(port, value):
+    pass
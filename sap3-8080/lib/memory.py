@@ -1,48 +1,507 @@
 import math
+import operator
 import os
 
+class Watchpoint:
+    '''Range of addresses (inclusive) that calls callback(address, kind, value) on a matching access - kinds is any of "rwx"'''
+
+    def __init__(self, start, end, kinds, callback):
+        self.start = start
+        self.end = end
+        self.kinds = kinds
+        self.callback = callback
+
+        self.hits = 0
+
+
+
 class Memory:
-    def __init__(self, size, width = 8):
+    def __init__(self, size, width = 8, page_bits = 8):
         self.size = size
         self.width = width
         self.hex_width = math.ceil(self.width // 4)
         self.max_value = 2 ** width - 1
 
-        self.contents = [0] * size
+        # bytes are stored in a bytearray, so whole pages and images can be copied in and out with a single slice
+        self.contents = bytearray(size) if width <= 8 else [0] * size
+
+        # list of (address, old value, new value) tuples - set by a trace recorder to capture writes
+        self.write_log = None
+
+        # per-page lists of watchpoints - None for unwatched pages, which skip the watchpoint checks entirely
+        self.page_bits = page_bits
+        self.watched = [None] * (((size - 1) >> page_bits) + 1)
+        self.watchpoints = []
+
+        # memory map - per-page read and write handlers, None for RAM pages, which are read and written directly
+        # ROM pages only have a write handler, unmapped and memory-mapped I/O pages have both - see map()
+        # Watched pages get handlers too (for the contents, if they'd otherwise have none), so an access to plain RAM
+        # only ever checks one table, and everything else goes through the slow path that checks watchpoints
+        self.read_map = [None] * len(self.watched)
+        self.write_map = [None] * len(self.watched)
+        self.page_kinds = ["ram"] * len(self.watched)
+
+        # bank-switched windows - extra backing stores, and per page the (store, offset from address to store index,
+        # image index of the store) the page shows, or None. The image is the contents followed by every store.
+        self.stores = []
+        self.store_bases = []
+        self.windows = [None] * len(self.watched)
+
+        # 64-bit hash of the image, kept up to date on every write once hash weights are set - see lib.statehash
+        self.hash_weights = None
+        self.contents_hash = 0
     
 
     def __getitem__(self, address):
+        if self.read_map[address >> self.page_bits] is not None:
+            return self.read_mapped(address, "r")
+
         return self.contents[address]
 
 
     def __setitem__(self, address, value):
-        self.contents[address] = value & self.max_value
+        value &= self.max_value
+
+        if self.write_map[address >> self.page_bits] is not None:
+            return self.write_mapped(address, value)
+
+        if self.write_log is not None:
+            self.write_log.append((address, self.contents[address], value))
+
+        if self.hash_weights is not None:
+            self.contents_hash = (self.contents_hash + (value - self.contents[address]) * self.hash_weights[address]) & 0xFFFF_FFFF_FFFF_FFFF
+
+        self.contents[address] = value
+
+
+    def fetch(self, address):
+        '''Read an instruction opcode - the only kind of access that triggers execute watchpoints'''
+
+        if self.read_map[address >> self.page_bits] is not None:
+            return self.read_mapped(address, "x")
+
+        return self.contents[address]
 
 
     def peek(self, address):
+        '''Read without side effects - through bank windows, but not device handlers, so debuggers can look at anything'''
+
+        if (window := self.windows[address >> self.page_bits]) is not None:
+            return window[0][address + window[1]]
+
         return self.contents[address]
 
 
     def poke(self, address, value):
+        if (window := self.windows[address >> self.page_bits]) is not None:
+            return self.poke_window(window, address, value)
+
+        if self.hash_weights is not None:
+            self.contents_hash = (self.contents_hash + (value - self.contents[address]) * self.hash_weights[address]) & 0xFFFF_FFFF_FFFF_FFFF
+
         self.contents[address] = value
 
 
+    def image_pages(self, page_size):
+        '''The image (the contents, then each store) as bytes objects of up to page_size - joined, they can be restored'''
+
+        for buffer in (self.contents, *self.stores):
+            for start in range(0, len(buffer), page_size):
+                yield bytes(buffer[start:start + page_size])
+
+
+    def restore(self, image):
+        '''Replace the whole image (in place) with a saved one - stores added since it was saved are left as they are'''
+
+        self.contents[:] = image[:self.size]
+
+        for store, base in zip(self.stores, self.store_bases):
+            if base + len(store) <= len(image):
+                store[:] = image[base:base + len(store)]
+
+        self.rehash()
+
+
+    def copy_in(self, address, data):
+        '''
+        Block write (e.g. DMA) - one slice copy from any buffer, bypassing watchpoints and the write log
+        Any pages in the range that aren't RAM are written a byte at a time through the memory map, like CPU stores,
+        so ROM stays read-only and memory-mapped devices see the writes
+        '''
+
+        end = address + len(data)
+        first, last = address >> self.page_bits, (end - 1) >> self.page_bits
+
+        if not any(self.write_map[first:last + 1]):
+            self.write_contents(address, data)
+            return
+
+        for page in range(first, last + 1):
+            start = max(address, page << self.page_bits)
+            stop = min(end, (page + 1) << self.page_bits)
+            chunk = data[start - address:stop - address]
+
+            # watched RAM pages have a write handler too, but it's only there to route CPU stores to the watchpoints
+            if self.page_kinds[page] == "ram":
+                self.write_contents(start, chunk)
+            elif (window := self.windows[page]) is not None:
+                self.write_store(window, start, chunk)
+            else:
+                for offset, value in enumerate(chunk):
+                    self.write_map[page](start + offset, value)
+
+
+    def write_contents(self, address, data):
+        '''Block write straight into the contents, ignoring the memory map - for loading images, including into ROM'''
+
+        end = address + len(data)
+
+        if self.hash_weights is not None:
+            change = self.weighted_sum(address, data) - self.weighted_sum(address, self.contents[address:end])
+            self.contents_hash = (self.contents_hash + change) & 0xFFFF_FFFF_FFFF_FFFF
+
+        self.contents[address:end] = data
+
+
+    def view(self, address, length):
+        '''
+        Block read - a memoryview of the contents (or of a store, within a single window), which shouldn't be kept
+        A range that spans windows and other pages is copied, and comes back read-only
+        '''
+
+        first, last = address >> self.page_bits, (address + length - 1) >> self.page_bits
+        windows = self.windows[first:last + 1]
+
+        if not any(windows):
+            return memoryview(self.contents)[address:address + length]
+
+        if all(window is windows[0] for window in windows):
+            store, offset, _ = windows[0]
+            return store[address + offset:address + offset + length]
+
+        chunks = []
+
+        for page in range(first, last + 1):
+            start = max(address, page << self.page_bits)
+            stop = min(address + length, (page + 1) << self.page_bits)
+            chunks.append(self.view(start, stop - start))
+
+        return memoryview(b''.join(chunks))
+
+
+    def find(self, value, start = 0):
+        '''Address of the first byte equal to value at or after start, or -1 - looking through bank windows'''
+
+        if not any(self.windows[start >> self.page_bits:]):
+            return self.contents.find(value, start)
+
+        page_size = 1 << self.page_bits
+
+        while start < self.size:
+            stop = min(((start >> self.page_bits) + 1) * page_size, self.size)
+
+            if (index := bytes(self.view(start, stop - start)).find(value)) != -1:
+                return start + index
+
+            start = stop
+
+        return -1
+
+
+    def set_hash_weights(self, weights):
+        '''Start (or with None, stop) hashing the image incrementally - one random 64-bit weight per address'''
+
+        self.hash_weights = weights
+        self.rehash()
+
+
+    def rehash(self):
+        if self.hash_weights is not None:
+            total = self.weighted_sum(0, self.contents)
+            total += sum(self.weighted_sum(base, store) for store, base in zip(self.stores, self.store_bases))
+
+            self.contents_hash = total & 0xFFFF_FFFF_FFFF_FFFF
+
+
+    def weighted_sum(self, index, data):
+        '''
+        Sum of value * weight over data, placed at index in the image
+        Stores reuse the weights for the contents, times an odd factor for each time round, so they needn't be as long
+        '''
+
+        weights = self.hash_weights
+        count = len(weights)
+        total = 0
+        done = 0
+
+        while done < len(data):
+            position = (index + done) % count
+            length = min(len(data) - done, count - position)
+
+            chunk = sum(map(operator.mul, data[done:done + length], weights[position:position + length]))
+            total += chunk * (2 * ((index + done) // count) + 1)
+            done += length
+
+        return total
+
+
+    def watch(self, start, end = None, kinds = "w", callback = None):
+        '''Add a watchpoint on the addresses start - end (inclusive), marking every page it touches as watched'''
+
+        end = start if end is None else end
+
+        if not 0 <= start <= end < self.size:
+            raise ValueError(f"Invalid Watchpoint Range: {start:04x} - {end:04x}")
+
+        watchpoint = Watchpoint(start, end, kinds, callback)
+        self.watchpoints.append(watchpoint)
+
+        for page in range(start >> self.page_bits, (end >> self.page_bits) + 1):
+            self.watched[page] = (self.watched[page] or []) + [watchpoint]
+            self.route_watched(page)
+
+        return watchpoint
+
+
+    def unwatch(self, watchpoint):
+        self.watchpoints.remove(watchpoint)
+
+        for page in range(watchpoint.start >> self.page_bits, (watchpoint.end >> self.page_bits) + 1):
+            remaining = [other for other in self.watched[page] if other is not watchpoint]
+            self.watched[page] = remaining or None
+            self.route_watched(page)
+
+
+    def route_watched(self, page):
+        '''Give a watched page contents handlers where it has none, so its accesses take the slow path - or take them away'''
+
+        watched = self.watched[page] is not None
+
+        if watched and self.read_map[page] is None:
+            self.read_map[page] = self.read_contents
+        elif not watched and self.read_map[page] == self.read_contents:
+            self.read_map[page] = None
+
+        if watched and self.write_map[page] is None:
+            self.write_map[page] = self.write_contents_byte
+        elif not watched and self.write_map[page] == self.write_contents_byte:
+            self.write_map[page] = None
+
+
+    def check_watchpoints(self, address, kind, value):
+        '''Slow path for accesses to watched pages'''
+
+        for watchpoint in self.watched[address >> self.page_bits]:
+            if kind in watchpoint.kinds and watchpoint.start <= address <= watchpoint.end:
+                watchpoint.hits += 1
+
+                if watchpoint.callback:
+                    watchpoint.callback(address, kind, value)
+
+
+    '''Memory map'''
+
+
+    def map(self, start, end, kind, read = None, write = None):
+        '''
+        Set the kind of the pages spanning start - end (inclusive, whole pages only)
+        "ram" - read and written directly (the default)
+        "rom" - read directly, writes are ignored, or with write given, call write(address, value) instead
+        "unmapped" - reads return all 1s (a floating bus), writes are ignored
+        "mmio" - reads call read(address) and writes call write(address, value), e.g. on a device's registers
+        "window" - a bank-switched window, once map_window() has said what it shows
+        '''
+
+        page_size = 1 << self.page_bits
+
+        if not 0 <= start <= end < self.size or start % page_size or (end + 1) % page_size:
+            raise ValueError(f"Invalid Memory Map Range: {start:04x} - {end:04x} (must be whole {page_size}-byte pages)")
+
+        match kind:
+            case "ram":
+                read = write = None
+            case "rom":
+                read, write = None, write or self.ignore_write
+            case "unmapped":
+                read, write = self.unmapped_read, self.ignore_write
+            case "mmio":
+                read, write = read or self.unmapped_read, write or self.ignore_write
+            case "window":
+                read, write = self.read_window, self.write_window
+            case _:
+                raise ValueError(f"Invalid Memory Map Kind: {kind}")
+
+        for page in range(start >> self.page_bits, (end >> self.page_bits) + 1):
+            self.read_map[page] = read
+            self.write_map[page] = write
+            self.page_kinds[page] = kind
+            self.windows[page] = None
+            self.route_watched(page)
+
+
+    def add_store(self, store):
+        '''Add a backing store (a writable memoryview) for bank windows - returns its number, for map_window()'''
+
+        self.store_bases.append(self.size + sum(len(other) for other in self.stores))
+        self.stores.append(store)
+        self.rehash()
+
+        return len(self.stores) - 1
+
+
+    def map_window(self, start, end, store, offset):
+        '''
+        Show bytes offset - offset + (end - start) of a store at start - end (inclusive, whole pages only)
+        Mapping the window again at another offset switches banks - only page table entries change, no bytes are copied.
+        Windows are read and written like RAM, and peek, poke, view, copy_in, the write log, and the hash all see through them.
+        '''
+
+        if not 0 <= offset <= len(self.stores[store]) - (end - start + 1):
+            raise ValueError(f"Window at {start:04x} - {end:04x} runs off the end of store {store}")
+
+        self.map(start, end, "window")
+
+        window = (self.stores[store], offset - start, self.store_bases[store])
+
+        for page in range(start >> self.page_bits, (end >> self.page_bits) + 1):
+            self.windows[page] = window
+
+
+    def map_rom(self, start, end, image = None, trap = None):
+        '''Make start - end read-only, after loading image into it - trap(address, value) is called on writes'''
+
+        if image is not None:
+            self.write_contents(start, image)
+
+        self.map(start, end, "rom", write = trap)
+
+
+    def regions(self):
+        '''The memory map as a list of (start, end, kind), merging neighbouring pages of the same kind'''
+
+        page_size = 1 << self.page_bits
+        regions = []
+
+        # leaving out the handlers that only route watched pages to their watchpoints
+        def handlers(page):
+            return [None if handler in (self.read_contents, self.write_contents_byte) else handler
+                    for handler in (self.read_map[page], self.write_map[page])]
+
+        for page, kind in enumerate(self.page_kinds):
+            if regions and regions[-1][2] == kind and handlers(page) == handlers(page - 1):
+                regions[-1][1] = (page + 1) * page_size - 1
+            else:
+                regions.append([page * page_size, (page + 1) * page_size - 1, kind])
+
+        return [tuple(region) for region in regions]
+
+
+    def read_mapped(self, address, kind):
+        '''Slow path for reads from non-RAM and watched pages'''
+
+        value = self.read_map[address >> self.page_bits](address) & self.max_value
+
+        if self.watched[address >> self.page_bits]:
+            self.check_watchpoints(address, kind, value)
+
+        return value
+
+
+    def write_mapped(self, address, value):
+        '''Slow path for writes to non-RAM and watched pages - the handler does any logging and hashing'''
+
+        self.write_map[address >> self.page_bits](address, value)
+
+        if self.watched[address >> self.page_bits]:
+            self.check_watchpoints(address, "w", value)
+
+
+    def read_contents(self, address):
+        return self.contents[address]
+
+
+    def write_contents_byte(self, address, value):
+        if self.write_log is not None:
+            self.write_log.append((address, self.contents[address], value))
+
+        if self.hash_weights is not None:
+            self.contents_hash = (self.contents_hash + (value - self.contents[address]) * self.hash_weights[address]) & 0xFFFF_FFFF_FFFF_FFFF
+
+        self.contents[address] = value
+
+
+    def read_window(self, address):
+        store, offset, _ = self.windows[address >> self.page_bits]
+        return store[address + offset]
+
+
+    def write_window(self, address, value):
+        window = self.windows[address >> self.page_bits]
+
+        if self.write_log is not None:
+            self.write_log.append((address, window[0][address + window[1]], value))
+
+        self.poke_window(window, address, value)
+
+
+    def poke_window(self, window, address, value):
+        store, offset, base = window
+        index = address + offset
+
+        if self.hash_weights is not None:
+            change = (value - store[index]) * self.weighted_sum(base + index, b"\x01")
+            self.contents_hash = (self.contents_hash + change) & 0xFFFF_FFFF_FFFF_FFFF
+
+        store[index] = value
+
+
+    def write_store(self, window, address, data):
+        store, offset, base = window
+        index = address + offset
+
+        if self.hash_weights is not None:
+            change = self.weighted_sum(base + index, data) - self.weighted_sum(base + index, store[index:index + len(data)])
+            self.contents_hash = (self.contents_hash + change) & 0xFFFF_FFFF_FFFF_FFFF
+
+        store[index:index + len(data)] = data
+
+
+    def unmapped_read(self, address):
+        return self.max_value
+
+
+    def ignore_write(self, address, value):
+        pass
+
+
     def clear(self):
-        self.contents = [0] * self.size
+        '''Zero every RAM page - ROM keeps its image, and other pages aren't backed by the contents anyway'''
+
+        if set(self.page_kinds) == {"ram"}:
+            self.contents[:] = bytes(self.size) if self.width <= 8 else [0] * self.size
+
+        else:
+            page_size = 1 << self.page_bits
+
+            for page, kind in enumerate(self.page_kinds):
+                if kind == "ram":
+                    start, end = page * page_size, min((page + 1) * page_size, self.size)
+                    self.contents[start:end] = bytes(end - start) if self.width <= 8 else [0] * (end - start)
+
+        self.rehash()
 
 
     def write(self, program, start_address = 0):
         if not 0 <= start_address < self.size:
             raise ValueError(f"Invalid Starting Address: {start_address}")
 
-        elif isinstance(program, list):
+        elif isinstance(program, (list, bytes, bytearray)):
             end_address = start_address + len(program) - 1
 
             if end_address >= self.size:
                 raise IndexError(f"Program too large")
 
-            for i in range(start_address, end_address + 1):
-                self.contents[i] = program[i]
+            self.contents[start_address:end_address + 1] = program
 
         elif os.path.isfile(program) and os.path.exists(program):
             file_ext = os.path.splitext(program)[1]
@@ -75,6 +534,8 @@ class Memory:
         else:
             raise ValueError("Invalid File")
 
+        self.rehash()
+
 
     def hex_dump(self, start_address = None, end_address = None):
         if not (start_address or end_address):
@@ -96,7 +557,7 @@ class Memory:
         print()
 
         for i in range(first_value, last_value, 16):
-            line = self.contents[i:i+16]
+            line = bytes(self.view(i, 16))
 
             if line == prev_line:
                 consecutive_lines += 1
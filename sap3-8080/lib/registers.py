@@ -22,7 +22,7 @@ class Register:
 
     @value.setter
     def value(self, new_value):
-        self.carry = new_value > self.max_value
+        self.carry = not 0 <= new_value <= self.max_value
         self._value = new_value & self.max_value
 
     
@@ -175,7 +175,7 @@ class PseudoRegister(Register):
 
     @value.setter
     def value(self, new_value):
-        self.carry = new_value > self.max_value
+        self.carry = not 0 <= new_value <= self.max_value
         self.memory[self.pointer_register.value] = new_value
 
 
@@ -198,6 +198,9 @@ class FlagsRegister(Register):
         self.flags = dict.fromkeys(flag_index.keys(), False)
         self.index = flag_index
 
+        # bits that always read as 1, regardless of the flags
+        self.fixed_bits = 0
+
 
     def __getitem__(self, flag):
         return self.flags[flag]
@@ -209,7 +212,7 @@ class FlagsRegister(Register):
     
     @property
     def value(self):
-        value = 0
+        value = self.fixed_bits
 
         for flag in self.flags.keys():
             value |= self.flags[flag] << self.index[flag]
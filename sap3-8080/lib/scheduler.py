@@ -0,0 +1,150 @@
+'''Module for scheduling device events at specific emulated cycles'''
+
+import collections
+import heapq
+import itertools
+import math
+
+
+class Event:
+    '''A callback due at a cycle - call Scheduler.cancel to drop it. interrupts is whether it can request an interrupt'''
+
+    __slots__ = ("due", "callback", "cancelled", "interrupts")
+
+    def __init__(self, due, callback, interrupts = False):
+        self.due = due
+        self.callback = callback
+        self.cancelled = False
+        self.interrupts = interrupts
+
+
+
+class Scheduler:
+    '''
+    Priority queue of timed callbacks, keyed on the clock's cycle count
+
+    next_due is the cycle of the earliest event (infinity when there are none), so the CPU only has to compare
+    it with the cycle count before each instruction. Due events are called with the cycle they were due at,
+    which can be a little before the current cycle, so periodic events can reschedule from it without drifting.
+    Events run at instruction boundaries, in due order - events due at the same cycle run in the order scheduled.
+
+    Other threads can't use the queue, but they can post() callbacks to run at the next instruction boundary.
+    '''
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.events = []
+        self.order = itertools.count()
+        self.next_due = math.inf
+
+        # callbacks posted from other threads - a deque, since appending and popping from either end is thread-safe
+        self.posted = collections.deque()
+
+
+    def __len__(self):
+        return sum(1 for _, _, event in self.events if not event.cancelled)
+
+
+    def schedule(self, delay, callback, interrupts = False):
+        '''Call callback(due cycle) delay cycles from now - with interrupts, the callback may request an interrupt'''
+
+        return self.at(self.clock.cycles + delay, callback, interrupts)
+
+
+    def at(self, cycle, callback, interrupts = False):
+        '''Call callback(due cycle) once the cycle count reaches cycle'''
+
+        event = Event(cycle, callback, interrupts)
+        heapq.heappush(self.events, (cycle, next(self.order), event))
+        self.update_next_due()
+
+        return event
+
+
+    def post(self, callback):
+        '''Call callback(current cycle) at the next instruction boundary - the only method safe to call from other threads'''
+
+        self.posted.append(callback)
+
+        # makes the CPU call run_due before its next instruction
+        self.next_due = -math.inf
+
+
+    def cancel(self, event):
+        # cancelled events stay in the heap until they come up, unless they're at the front
+        event.cancelled = True
+        self.drop_cancelled()
+
+
+    def run_due(self):
+        '''Call every event due by the current cycle (including any they schedule that are already due)'''
+
+        events = self.events
+        posted = self.posted
+
+        while posted:
+            posted.popleft()(self.clock.cycles)
+
+        while events and events[0][0] <= self.clock.cycles:
+            due, _, event = heapq.heappop(events)
+
+            if not event.cancelled:
+                event.cancelled = True
+                event.callback(due)
+
+        self.drop_cancelled()
+
+
+    def interrupting(self):
+        '''Whether any event to come can request an interrupt - a halted CPU only waits for events that can wake it'''
+
+        return any(event.interrupts and not event.cancelled for _, _, event in self.events)
+
+
+    def drop_cancelled(self):
+        events = self.events
+
+        while events and events[0][2].cancelled:
+            heapq.heappop(events)
+
+        self.update_next_due()
+
+
+    def update_next_due(self):
+        self.next_due = self.events[0][0] if self.events else math.inf
+
+        # checked after setting next_due, so a callback posted meanwhile can't be missed
+        if self.posted:
+            self.next_due = -math.inf
+
+
+    def rebase(self, cycles):
+        '''Shift every event back by cycles, e.g. when the clock's cycle count is reset, so they keep their timing'''
+
+        self.events = [(due - cycles, order, event) for due, order, event in self.events]
+
+        for due, _, event in self.events:
+            event.due = due
+
+        heapq.heapify(self.events)
+        self.drop_cancelled()
+
+
+    def save_state(self):
+        '''The queue as it stands - restoring it puts back these same Event objects, so devices can keep theirs'''
+
+        return [(due, order, event, event.cancelled) for due, order, event in self.events]
+
+
+    def load_state(self, state):
+        for due, _, event, cancelled in state:
+            event.due = due
+            event.cancelled = cancelled
+
+        self.events = [(due, order, event) for due, order, event, _ in state]
+        self.drop_cancelled()
+
+
+    def clear(self):
+        self.events.clear()
+        self.drop_cancelled()
@@ -0,0 +1,123 @@
+'''Module for storing many CPU states cheaply - memory pages are stored once by content hash, compressed'''
+
+import hashlib
+import zlib
+from array import array
+
+from lib.registers import DoubleRegister, PseudoRegister
+
+
+class Snapshot:
+    '''Register state plus the id of every memory page in the store, and the rest of the machine from cpu.save_state()'''
+
+    def __init__(self, registers, halt, cycles, pages, machine):
+        self.registers = registers
+        self.halt = halt
+        self.cycles = cycles
+        self.pages = pages
+        self.machine = machine
+
+
+
+class SnapshotStore:
+    '''
+    Content-addressed store of CPU snapshots
+
+    Each unique page is zlib-compressed and stored once, found by its hash, so snapshots that only
+    differ in a few pages only cost those pages plus an array of page ids. Identical page arrays are shared too.
+    '''
+
+    def __init__(self, page_size = 256, level = 1, cache_pages = 4096):
+        self.page_size = page_size
+        self.level = level
+
+        # page id: compressed page, and page hash: page id
+        self.pages = []
+        self.ids = {}
+
+        # page id: decompressed page, for the pages loaded most recently
+        self.cache = {}
+        self.cache_pages = cache_pages
+
+        # bytes of a page id array: the array, so identical memory images share one array
+        self.page_lists = {}
+
+        # the page id array and memory image of the last snapshot loaded, so reloading it is a single copy
+        self.image_pages = None
+        self.image = None
+
+        self.snapshots = []
+
+
+    def __len__(self):
+        return len(self.snapshots)
+
+
+    def __getitem__(self, index):
+        return self.snapshots[index]
+
+
+    def save(self, cpu):
+        '''Store the CPU's current state, returning the snapshot's index'''
+
+        ids = self.ids
+
+        page_ids = array('I')
+
+        for page in cpu.memory.image_pages(self.page_size):
+            digest = hashlib.blake2b(page, digest_size = 16).digest()
+
+            if (page_id := ids.get(digest)) is None:
+                page_id = ids[digest] = len(self.pages)
+                self.pages.append(zlib.compress(page, self.level))
+
+            page_ids.append(page_id)
+
+        page_ids = self.page_lists.setdefault(page_ids.tobytes(), page_ids)
+
+        registers = tuple(register.value for register in state_registers(cpu))
+        self.snapshots.append(Snapshot(registers, cpu.halt, cpu.clock.cycles, page_ids, cpu.save_state()))
+
+        return len(self.snapshots) - 1
+
+
+    def load(self, cpu, index):
+        '''Put the CPU back in the state of a stored snapshot'''
+
+        snapshot = self.snapshots[index]
+
+        for register, value in zip(state_registers(cpu), snapshot.registers):
+            register.value = value
+
+        cpu.halt = snapshot.halt
+        cpu.stopped = False
+        cpu.clock.cycles = snapshot.cycles
+        cpu.clock.stopped = snapshot.halt
+        cpu.load_state(snapshot.machine)
+
+        if snapshot.pages is not self.image_pages:
+            self.image = b''.join(self.page(page_id) for page_id in snapshot.pages)
+            self.image_pages = snapshot.pages
+
+        cpu.memory.restore(self.image)
+
+
+    def page(self, page_id):
+        if (page := self.cache.get(page_id)) is None:
+            if len(self.cache) >= self.cache_pages:
+                self.cache.clear()
+
+            page = self.cache[page_id] = zlib.decompress(self.pages[page_id])
+
+        return page
+
+
+    @property
+    def nbytes(self):
+        '''Approximate bytes held - compressed pages, their hashes, and the unique page id arrays'''
+
+        return sum(len(page) + 16 for page in self.pages) + sum(len(page_ids) for page_ids in self.page_lists)
+
+
+def state_registers(cpu):
+    return [register for register in cpu.registers if not isinstance(register, (DoubleRegister, PseudoRegister))]
@@ -0,0 +1,151 @@
+'''Module for hashing the whole machine state incrementally, and using it to catch programs stuck in an infinite loop'''
+
+import math
+import random
+
+from lib.input import InputDevice
+from lib.registers import DoubleRegister, PseudoRegister
+from lib.uart import UART
+
+_weights = {}
+
+
+def hash_weights(size, seed = 8080):
+    '''One random 64-bit weight per memory address - the same for every CPU, so hashes compare across runs'''
+
+    if (size, seed) not in _weights:
+        generator = random.Random(seed)
+        _weights[size, seed] = [generator.getrandbits(64) for _ in range(size)]
+
+    return _weights[size, seed]
+
+
+
+class StateHash:
+    '''
+    64-bit hash of the registers, flags, memory (including any bank-switched stores), interrupt state,
+    and input read positions of a CPU - so a program polling through buffered input doesn't look like it repeats
+
+    Memory is hashed as the sum of value * weight over every address, which Memory updates in O(1) on each write,
+    so reading the hash only costs hashing the registers. The cycle count isn't part of the state.
+    '''
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.memory = cpu.memory
+        self.registers = [register for register in cpu.registers if not isinstance(register, (DoubleRegister, PseudoRegister))]
+
+        self.memory.set_hash_weights(hash_weights(self.memory.size))
+
+
+    def value(self):
+        return hash((self.memory.contents_hash, self.cpu.halt, *self.interrupts(), *self.inputs(), *[register.value for register in self.registers]))
+
+
+    def state(self):
+        '''Full copy of the state, for telling real repeats apart from hash collisions'''
+
+        return self.cpu.halt, self.interrupts(), self.inputs(), [register.value for register in self.registers], b''.join(self.memory.image_pages(4096))
+
+
+    def interrupts(self):
+        cpu = self.cpu
+        return cpu.interrupts_enabled, cpu.interrupt_request, cpu.enabled_at == cpu.clock.cycles
+
+
+    def inputs(self):
+        '''How far each input buffer has been read, and how far it's been filled'''
+
+        buffers = [device.rx if isinstance(device, UART) else device for device in self.cpu.devices if isinstance(device, (InputDevice, UART))]
+        return tuple((buffer.head, buffer.tail) for buffer in buffers)
+
+
+    def close(self):
+        self.memory.set_hash_weights(None)
+
+
+
+class LoopDetector:
+    '''
+    Runs a CPU until it halts, is stopped, or provably repeats an earlier state (an infinite loop without a HLT)
+
+    The state is hashed every interval instructions and compared against a saved state using Brent's algorithm,
+    so any loop is found within a small multiple of its length, using constant memory.
+    Scheduled events, requested interrupts, devices that can interrupt from another thread, and input still arriving
+    from another thread aren't part of the state, so nothing counts as a loop while there are any.
+    '''
+
+    def __init__(self, cpu, interval = 64):
+        self.cpu = cpu
+        self.interval = interval
+        self.state_hash = StateHash(cpu)
+
+        self.looping = False
+
+        # a multiple of the loop's length, in instructions
+        self.period = None
+
+
+    def run(self, max_instructions = None):
+        '''Returns True if the CPU stopped because it was looping'''
+
+        cpu = self.cpu
+        cpu.stopped = False
+
+        saved_hash = saved_state = None
+        power = length = 1
+        executed = 0
+
+        while not (cpu.halt or cpu.stopped):
+            if self.waiting():
+                # a scheduled event or a requested interrupt can still change things - start over once it's done
+                saved_hash = saved_state = None
+
+            elif saved_hash is None:
+                saved_hash = self.state_hash.value()
+                saved_state = self.state_hash.state()
+                power = length = 1
+
+            for _ in range(self.interval):
+                cpu.fetch_instruction()
+                cpu.execute_instruction()
+
+                if cpu.halt or cpu.stopped:
+                    return False
+
+            executed += self.interval
+
+            if saved_hash is not None and not self.waiting():
+                if (current := self.state_hash.value()) == saved_hash and self.state_hash.state() == saved_state:
+                    self.looping = True
+                    self.period = length * self.interval
+                    cpu.stopped = True
+                    return True
+
+                if length == power:
+                    saved_hash = current
+                    saved_state = self.state_hash.state()
+                    power *= 2
+                    length = 0
+
+                length += 1
+
+            if max_instructions is not None and executed >= max_instructions:
+                return False
+
+        return False
+
+
+    def waiting(self):
+        '''Whether anything outside the hashed state is due to happen'''
+
+        cpu = self.cpu
+
+        if cpu.scheduler.next_due != math.inf or cpu.interrupt_request is not None or cpu.interrupt_sources > 0:
+            return True
+
+        return any(device.feeding for device in cpu.devices if isinstance(device, (InputDevice, UART)))
+
+
+    def close(self):
+        self.state_hash.close()
@@ -0,0 +1,218 @@
+'''Module for an 8253-style programmable interval timer, counting emulated cycles'''
+
+# counter modes
+INTERRUPT_ON_TERMINAL_COUNT = 0
+RATE_GENERATOR = 2
+SQUARE_WAVE = 3
+SOFTWARE_STROBE = 4
+
+# read/write modes from the control word
+LATCH = 0
+LOW_BYTE = 1
+HIGH_BYTE = 2
+LOW_THEN_HIGH = 3
+
+'''
+Ports, from the timer's base port
+
++0 - +2  counters 0 - 2 - write the initial count, read the current (or latched) count
++3       control word (out) - SC1 SC0 RW1 RW0 M2 M1 M0 BCD
+
+Modes 0 and 4 count down once and stop (a one-shot), modes 2 and 3 reload and repeat (a periodic rate).
+Modes 1 and 5 need the hardware gate input, so they count down once like mode 0. BCD counting isn't supported.
+'''
+
+
+class Counter:
+    '''One of the timer's three counters'''
+
+    def __init__(self, timer, index):
+        self.timer = timer
+        self.index = index
+
+        self.mode = INTERRUPT_ON_TERMINAL_COUNT
+        self.access = LOW_THEN_HIGH
+
+        # count being written, and whether the next byte read or written is the high byte
+        self.initial = 0
+        self.write_high = False
+        self.read_high = False
+        self.latched = None
+
+        # the count in use, the cycle it was loaded at, and its terminal count event
+        self.count = 0
+        self.start = None
+        self.event = None
+
+        # number of times the count reached 0
+        self.terminal_counts = 0
+
+
+    def save_state(self):
+        return (self.mode, self.access, self.initial, self.write_high, self.read_high, self.latched,
+                self.count, self.start, self.event, self.terminal_counts)
+
+
+    def load_state(self, state):
+        (self.mode, self.access, self.initial, self.write_high, self.read_high, self.latched,
+         self.count, self.start, self.event, self.terminal_counts) = state
+
+
+    def rebase(self, cycles):
+        if self.start is not None:
+            self.start -= cycles
+
+
+    def control(self, access, mode):
+        if access == LATCH:
+            self.latched = self.value()
+            return
+
+        self.stop()
+        self.access = access
+        self.mode = mode if mode < 6 else mode & 0b011
+        self.write_high = self.read_high = False
+
+
+    def write(self, value):
+        if self.access == LOW_BYTE:
+            self.load(value)
+
+        elif self.access == HIGH_BYTE:
+            self.load(value << 8)
+
+        elif self.write_high:
+            self.load(self.initial | value << 8)
+            self.write_high = False
+
+        else:
+            self.initial = value
+            self.write_high = True
+            self.stop()
+
+
+    def read(self):
+        value = self.latched if self.latched is not None else self.value()
+
+        if self.access != LOW_THEN_HIGH:
+            self.latched = None
+            return value & 0xFF if self.access == LOW_BYTE else value >> 8
+
+        self.read_high = not self.read_high
+
+        if self.read_high:
+            return value & 0xFF
+
+        self.latched = None
+        return value >> 8
+
+
+    def load(self, count):
+        '''Start counting down from count (0 counts 65536)'''
+
+        self.stop()
+
+        self.count = count or 0x10000
+        self.start = self.timer.clock.cycles
+        self.event = self.timer.scheduler.schedule(self.count * self.timer.divider, self.terminal_count, self.interrupts)
+
+
+    def stop(self):
+        if self.event:
+            self.timer.scheduler.cancel(self.event)
+
+        self.event = None
+        self.start = None
+
+
+    @property
+    def interrupts(self):
+        return self.timer.vectors[self.index] is not None
+
+
+    @property
+    def periodic(self):
+        return self.mode in (RATE_GENERATOR, SQUARE_WAVE)
+
+
+    def terminal_count(self, due):
+        self.terminal_counts += 1
+
+        if self.periodic:
+            self.start = due
+            self.event = self.timer.scheduler.at(due + self.count * self.timer.divider, self.terminal_count, self.interrupts)
+        else:
+            self.event = None
+
+        if (vector := self.timer.vectors[self.index]) is not None:
+            self.timer.cpu.interrupt(vector)
+
+
+    def value(self):
+        '''The current count, worked out from the cycles since it was loaded'''
+
+        if self.start is None:
+            return self.count & 0xFFFF
+
+        elapsed = (self.timer.clock.cycles - self.start) // self.timer.divider
+
+        if self.periodic:
+            return self.count - elapsed % self.count
+
+        # one-shots keep counting down (wrapping) after reaching 0
+        return (self.count - elapsed) & 0xFFFF
+
+
+
+class IntervalTimer:
+    '''
+    Three 16-bit down counters on I/O ports base - base + 3
+
+    Counters are clocked once every divider CPU cycles, and nothing runs between terminal counts - each counter
+    schedules an event for its next one, and works out its current count from the cycle count when it's read.
+    vectors is the RST vector each counter interrupts with at terminal count (None for no interrupt).
+    '''
+
+    def __init__(self, cpu, base_port = 0x40, divider = 1, vectors = (None, None, None)):
+        self.cpu = cpu
+        self.clock = cpu.clock
+        self.scheduler = cpu.scheduler
+        self.base_port = base_port
+        self.divider = divider
+        self.vectors = list(vectors)
+
+        self.counters = [Counter(self, i) for i in range(3)]
+
+        cpu.io.attach(range(base_port, base_port + 3), self.input, self.output)
+        cpu.io.attach(base_port + 3, output = self.output)
+        cpu.devices.append(self)
+
+
+    def save_state(self):
+        return [counter.save_state() for counter in self.counters]
+
+
+    def load_state(self, state):
+        for counter, counter_state in zip(self.counters, state):
+            counter.load_state(counter_state)
+
+
+    def rebase(self, cycles):
+        '''Shift the cycle each count was loaded at back by cycles, when the clock's cycle count is reset'''
+
+        for counter in self.counters:
+            counter.rebase(cycles)
+
+
+    def input(self, port):
+        return self.counters[port - self.base_port].read()
+
+
+    def output(self, port, value):
+        if port - self.base_port < 3:
+            self.counters[port - self.base_port].write(value)
+            return
+
+        # control word - counter 3 doesn't exist (it's the 8254's read-back command)
+        if (counter := value >> 6) < 3:
+            self.counters[counter].control(value >> 4 & 0b11, value >> 1 & 0b111)
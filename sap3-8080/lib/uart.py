@@ -0,0 +1,210 @@
+'''Module for an 8251-style serial UART, bridged to a TCP socket or a pseudo-terminal by background threads'''
+
+import collections
+import os
+import socket
+import threading
+import time
+
+from lib.input import InputDevice
+
+# status port bits
+TX_READY = 0x01
+RX_READY = 0x02
+TX_EMPTY = 0x04
+DSR = 0x80
+
+# command word bit that returns the UART to expecting a mode word
+INTERNAL_RESET = 0x40
+
+'''
+Ports, from the UART's base port
+
++0  data - IN takes the next received byte (0 if there isn't one), OUT queues a byte to send
++1  status (in) / mode and command words (out)
+
+Mode and command words are accepted but the line settings are ignored - bytes go out as fast as the host takes them.
+DSR is set while a client is connected. Nothing is sent when there isn't one, so a program can't get stuck waiting.
+'''
+
+
+class UART:
+    '''
+    Serial UART whose receive and transmit FIFOs are connected to a host stream
+
+    All host I/O happens in background threads - the CPU only ever touches the FIFOs, so reads, writes,
+    and status polls never wait on the socket. rx_vector is an RST vector to interrupt with when bytes arrive.
+    '''
+
+    def __init__(self, cpu, base_port = 0x10, rx_vector = None, capacity = 4096):
+        self.cpu = cpu
+        self.base_port = base_port
+        self.rx_vector = rx_vector
+        self.capacity = capacity
+
+        self.rx = InputDevice(capacity)
+        self.tx = collections.deque()
+        self.tx_ready = threading.Event()
+
+        # token of the current host connection, so threads left over from an old one can tell they're finished
+        self.connection = None
+        self.expect_mode = True
+        self.threads = []
+
+        cpu.io.attach(base_port, self.read_data, self.write_data)
+        cpu.io.attach(base_port + 1, self.status, self.control)
+        cpu.devices.append(self)
+
+        # bytes arrive on a receiving thread, so a halted CPU has to wait for them
+        if rx_vector is not None:
+            cpu.interrupt_sources += 1
+
+
+    @property
+    def connected(self):
+        return self.connection is not None
+
+
+    @property
+    def feeding(self):
+        '''Whether bytes can still arrive - a client is connected, or one can still connect'''
+
+        return self.connected or any(thread.is_alive() for thread in self.threads)
+
+
+    def save_state(self):
+        # only the receive side - bytes sent have already gone to the host
+        return self.rx.save_state(), self.expect_mode
+
+
+    def load_state(self, state):
+        rx, self.expect_mode = state
+        self.rx.load_state(rx)
+
+
+    '''I/O bus handlers'''
+
+
+    def read_data(self, port):
+        return self.rx.read()
+
+
+    def write_data(self, port, value):
+        if self.connection and len(self.tx) < self.capacity:
+            self.tx.append(value)
+            self.tx_ready.set()
+
+
+    def status(self, port):
+        status = TX_READY if len(self.tx) < self.capacity else 0
+
+        if not self.tx:
+            status |= TX_EMPTY
+        if self.rx.head != self.rx.tail:
+            status |= RX_READY
+        if self.connected:
+            status |= DSR
+
+        return status
+
+
+    def control(self, port, value):
+        # the first write after a reset is the mode word, then command words follow
+        if self.expect_mode:
+            self.expect_mode = False
+        elif value & INTERNAL_RESET:
+            self.expect_mode = True
+
+
+    '''Host side'''
+
+
+    def listen(self, host = "127.0.0.1", port = 8251):
+        '''Accept TCP clients (one at a time) in the background - returns the listening socket'''
+
+        server = socket.create_server((host, port))
+        self.start(self.accept, server)
+        return server
+
+
+    def open_pty(self):
+        '''Connect to a new pseudo-terminal - returns the path for a terminal program to open'''
+
+        master, slave = os.openpty()
+        self.connect(lambda size: os.read(master, size), lambda data: os.write(master, data))
+        return os.ttyname(slave)
+
+
+    def accept(self, server):
+        while True:
+            try:
+                client, _ = server.accept()
+            except OSError:
+                return
+
+            with client:
+                client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self.connect(client.recv, client.sendall, wait = True)
+
+
+    def connect(self, read, write, wait = False):
+        '''
+        Bridge the FIFOs to a host stream - read(size) returns bytes (empty when it closes), write(data) sends them
+        With wait, the receiving runs in this thread, returning when the stream closes
+        '''
+
+        connection = self.connection = object()
+        self.tx.clear()
+        self.start(self.sender, write, connection)
+
+        if wait:
+            self.receiver(read, connection)
+        else:
+            self.start(self.receiver, read, connection)
+
+
+    def start(self, target, *args):
+        thread = threading.Thread(target = target, args = args, daemon = True)
+        thread.start()
+        self.threads.append(thread)
+
+
+    def receiver(self, read, connection):
+        try:
+            while (data := read(256)):
+                while data:
+                    data = data[self.rx.feed(data):]
+
+                    if data:
+                        time.sleep(0.001)
+
+                if self.rx_vector is not None:
+                    self.cpu.post_interrupt(self.rx_vector)
+
+        except OSError:
+            pass
+
+        self.disconnect(connection)
+
+
+    def sender(self, write, connection):
+        tx = self.tx
+
+        try:
+            while self.connection is connection:
+                self.tx_ready.wait()
+                self.tx_ready.clear()
+
+                if tx and self.connection is connection:
+                    write(bytes(tx.popleft() for _ in range(len(tx))))
+
+        except OSError:
+            self.disconnect(connection)
+
+
+    def disconnect(self, connection):
+        if self.connection is connection:
+            self.connection = None
+
+        # wake the sender so it sees it's finished
+        self.tx_ready.set()
@@ -0,0 +1,99 @@
+'''Module for a memory-mapped text display - a region of memory drawn to the terminal a frame at a time'''
+
+import sys
+import threading
+
+# printable ASCII is shown as is, anything else as a space
+CHARACTERS = bytes(byte if 0x20 <= byte < 0x7F else 0x20 for byte in range(256))
+
+
+class VideoDisplay:
+    '''
+    Text display of columns x rows characters, one byte each, starting at address
+
+    Programs just store characters into the region - there's no per-store work at all. Instead, every frame
+    compares each row against what was last drawn and redraws only the rows that changed (none, when the
+    region hasn't changed), using ANSI escape codes. Frames are drawn fps times a second by a background thread,
+    in real time, so the refresh rate doesn't depend on how fast the emulation runs.
+    '''
+
+    def __init__(self, cpu, address = 0xF000, columns = 80, rows = 24, fps = 30, file = None):
+        if address + columns * rows > cpu.memory.size:
+            raise ValueError(f"Display doesn't fit in memory at {address:04x}")
+
+        self.memory = cpu.memory
+        self.address = address
+        self.columns = columns
+        self.rows = rows
+        self.fps = fps
+        self.file = file
+
+        self.size = columns * rows
+
+        # what's on the screen - None until the first frame, so every row is drawn
+        self.shown = None
+
+        self.frames = 0
+        self.rows_drawn = 0
+
+        self.stopping = threading.Event()
+        self.thread = None
+
+
+    def start(self):
+        '''Clear the terminal and start drawing frames'''
+
+        (self.file or sys.stdout).write("\x1b[2J")
+        self.shown = None
+
+        self.stopping.clear()
+        self.thread = threading.Thread(target = self.refresh, daemon = True)
+        self.thread.start()
+
+
+    def stop(self):
+        '''Stop drawing, after one last frame so the screen is up to date'''
+
+        self.stopping.set()
+
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+        self.render()
+
+
+    def refresh(self):
+        while not self.stopping.wait(1 / self.fps):
+            self.render()
+
+
+    def render(self):
+        '''Draw a frame - returns the number of rows redrawn'''
+
+        screen = bytes(self.memory.view(self.address, self.size))
+        shown = self.shown
+        self.frames += 1
+
+        if screen == shown:
+            return 0
+
+        columns = self.columns
+        output = []
+
+        for row in range(self.rows):
+            start = row * columns
+            line = screen[start:start + columns]
+
+            if shown is None or line != shown[start:start + columns]:
+                # move to the start of the row, then draw it
+                output.append(f"\x1b[{row + 1};1H{line.translate(CHARACTERS).decode('ascii')}")
+
+        self.shown = screen
+        self.rows_drawn += len(output)
+
+        file = self.file or sys.stdout
+        file.write("".join(output) + f"\x1b[{self.rows + 1};1H")
+        file.flush()
+
+        return len(output)
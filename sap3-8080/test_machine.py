@@ -0,0 +1,201 @@
+'''Regression tests for the emulator and its tools - run with pytest from this directory'''
+
+import io
+import math
+import os
+
+import gdbclient
+from cpu import CPU, INPUT_DATA_PORT
+from lib.apu import BUSY, ArithmeticUnit
+from lib.checkpoints import TimeTravel
+from lib.output import OutputSink
+from lib.statehash import LoopDetector
+from lib.timer import IntervalTimer
+from lib.trace import REG, TraceReader, TraceWriter
+
+
+def machine(program = (), start = 0, output = None):
+    '''A reset, unthrottled CPU with program loaded - output isn't displayed unless an output sink is given'''
+
+    cpu = CPU(output = output)
+    cpu.reset()
+    cpu.clock.stopped = True
+    cpu.output.display = output is not None
+    cpu.load(list(program), start)
+
+    return cpu
+
+
+def test_trace_records_acknowledged_interrupt(tmp_path):
+    # EI, NOP, NOP, HLT - and an RST 1 handler that halts
+    cpu = machine([0xFB, 0x00, 0x00, 0x76])
+    cpu.load([0x76], 0x0008)
+    cpu.SP.value = 0x8000
+
+    with TraceWriter(cpu, tmp_path / "trace") as writer:
+        writer.step()
+        cpu.interrupt(1)
+        writer.run()
+
+    reader = TraceReader(tmp_path / "trace")
+
+    # the step at 0002 ran the injected RST 1, not the NOP stored there
+    assert [reader[step][1:3] for step in range(len(reader))] == [(0x0000, 0xFB), (0x0001, 0x00), (0x0002, 0xCF), (0x0008, 0x76)]
+    assert reader.steps_at(0x0002) == [2]
+
+    # PC and IR come back from the STEP records
+    assert reader[2][4]["PC"] == 0x0008
+    assert reader[2][4]["IR"] == 0xCF
+    assert reader[1][4]["IR"] == 0x00
+
+    reader.close()
+
+
+def test_trace_has_no_pc_or_ir_register_records(tmp_path):
+    cpu = machine([0x3C, 0x3C, 0x76])
+
+    with TraceWriter(cpu, tmp_path / "trace") as writer:
+        writer.run()
+
+    reader = TraceReader(tmp_path / "trace")
+    names = [reader.register_names[byte] for kind, byte, *_ in (reader.record(i) for i in range(reader.record_count)) if kind == REG]
+
+    assert "PC" not in names and "IR" not in names
+    assert [reader[step][4] for step in range(len(reader))][:2] == [{"IR": 0x3C, "PC": 1, "A": 1}, {"PC": 2, "A": 2}]
+
+    reader.close()
+
+
+def test_condition_reads_m_without_watchpoints():
+    cpu = machine()
+    cpu.memory.poke(0x9000, 0x42)
+    cpu.HL.value = 0x9000
+
+    hits = []
+    cpu.watch(0x9000, kinds = "r", callback = lambda address, kind, value: hits.append(address))
+    breakpoint = cpu.add_breakpoint(0x0000, "M == 0x42")
+
+    assert breakpoint.matches(cpu.condition_scope)
+    assert hits == []
+
+
+def test_gdb_session():
+    # includes malformed packets, which get E01 without ending the session
+    assert gdbclient.check() == []
+
+
+def test_replay_does_not_write_to_file_sink():
+    # MVI A,1; OUT 0; INR A; OUT 0; INR A; OUT 0; HLT
+    file = io.StringIO()
+    cpu = machine([0x3E, 0x01, 0xD3, 0x00, 0x3C, 0xD3, 0x00, 0x3C, 0xD3, 0x00, 0x76], output = OutputSink(file, "hex", batch_size = 1))
+
+    time_travel = TimeTravel(cpu)
+    time_travel.run()
+    time_travel.step_back(2)
+
+    assert file.getvalue() == "01\n02\n03\n"
+    assert cpu.output.display
+
+
+def test_polling_buffered_input_is_not_a_loop():
+    # IN data; CPI 1; JNZ 0000; HLT - over 2000 zero bytes, then a 1
+    cpu = machine([0xDB, INPUT_DATA_PORT, 0xFE, 0x01, 0xC2, 0x00, 0x00, 0x76])
+    cpu.input.feed(bytes(2000) + b"\x01")
+
+    detector = LoopDetector(cpu)
+    assert not detector.run()
+    assert cpu.halt
+
+    # with the input used up and nothing feeding it, the same polling loop does repeat
+    cpu.reset()
+    assert detector.run()
+
+    # but not while a thread can still feed it
+    read, write = os.pipe()
+    cpu.input.feed_from(os.fdopen(read, "rb"))
+    cpu.reset()
+    assert not detector.run(max_instructions = 10_000)
+
+    os.close(write)
+    detector.close()
+
+
+def test_reset_mid_countdown_keeps_device_timing():
+    cpu = machine()
+    timer = IntervalTimer(cpu)
+    apu = ArithmeticUnit(cpu)
+
+    # counter 0, low then high byte, mode 0 - counting down from 1000
+    timer.output(0x43, 0b00110000)
+    timer.output(0x40, 1000 & 0xFF)
+    timer.output(0x40, 1000 >> 8)
+
+    # SQRT keeps the unit busy for 800 cycles
+    apu.command(0x51, 0x01)
+
+    cpu.clock.pulse(300)
+    cpu.reset()
+
+    counter = timer.counters[0]
+    assert counter.value() == 700
+    assert counter.event.due == 700
+
+    cpu.clock.pulse(499)
+    assert apu.read_status(0x51) & BUSY
+    cpu.clock.pulse(1)
+    assert not apu.read_status(0x51) & BUSY
+
+    cpu.clock.pulse(200)
+    cpu.scheduler.run_due()
+    assert counter.terminal_counts == 1
+    assert counter.value() == 0
+
+
+def test_posted_callback_survives_scheduling():
+    cpu = machine()
+    scheduler = cpu.scheduler
+    ran = []
+
+    scheduler.post(lambda cycle: ran.append("posted"))
+    scheduler.schedule(100, lambda due: ran.append("event"))
+    assert scheduler.next_due == -math.inf
+
+    # the posted callback runs at the next instruction boundary, not when the event comes due
+    cpu.fetch_instruction()
+    assert ran == ["posted"]
+    assert scheduler.next_due == 100
+
+
+def test_watchpoints_route_through_the_memory_map():
+    cpu = machine([0x3A, 0x00, 0x90, 0x32, 0x01, 0x90, 0x76])
+    memory = cpu.memory
+    memory.map_rom(0xA000, 0xA0FF, bytes([0x55]) * 0x100)
+
+    hits = []
+    watchpoint = cpu.watch(0x9000, 0x9001, "rw", lambda address, kind, value: hits.append((address, kind)))
+    rom_watchpoint = cpu.watch(0xA000, kinds = "rw", callback = lambda address, kind, value: hits.append((address, kind)))
+
+    # plain RAM pages have no handlers, so they take the fast path
+    assert memory.read_map[0x80] is None and memory.write_map[0x80] is None
+    assert memory.read_map[0x90] is not None and memory.write_map[0x90] is not None
+
+    # watching doesn't change the memory map
+    assert memory.regions() == [(0x0000, 0x9FFF, "ram"), (0xA000, 0xA0FF, "rom"), (0xA100, 0xFFFF, "ram")]
+
+    # LDA 9000; STA 9001
+    cpu.run()
+    assert hits == [(0x9000, "r"), (0x9001, "w")]
+
+    # ROM stays read-only and still reports its watchpoints
+    memory[0xA000] = 0x12
+    assert memory[0xA000] == 0x55
+    assert hits[2:] == [(0xA000, "w"), (0xA000, "r")]
+
+    # block writes bypass watchpoints
+    memory.copy_in(0x9000, b"\x07\x08")
+    assert memory.peek(0x9001) == 0x08 and len(hits) == 4
+
+    cpu.unwatch(watchpoint)
+    cpu.unwatch(rom_watchpoint)
+    assert memory.read_map[0x90] is None and memory.write_map[0x90] is None
+    assert memory.read_map[0xA0] is None and memory.write_map[0xA0] is not None
@@ -1,6 +1,8 @@
 '''Module for handling the "terminal" interface and user input'''
 import os
 
+from lib.checkpoints import TimeTravel
+
 def program_mode(cpu):
     '''Main terminal interface mode'''
 
@@ -34,6 +36,14 @@ def program_mode(cpu):
                     cpu.load(program)
                     cpu.run()
 
+                    if cpu.watch_hit:
+                        display_watch_hit(cpu)
+                        continue
+
+                    if cpu.breakpoint_hit:
+                        display_breakpoint_hit(cpu)
+                        continue
+
                     display_program_help()
                     current = get_address_from_user()
                     if current == -1:
@@ -70,6 +80,12 @@ def program_mode(cpu):
                 if current == -1:
                     return
 
+            case "watch":
+                add_watchpoint(cpu)
+
+            case "break":
+                add_breakpoint(cpu)
+
             case "save":
                 print("\nPlease input a file name to save your program to. \
                 \n  Include the extension (.hex for hex output or .bin for binary)")
@@ -151,15 +167,25 @@ def step_mode(cpu):
     input("\nPress enter to begin: ")
     display_state(cpu)
 
+    # frequent checkpoints keep each step back to a short replay
+    history = TimeTravel(cpu, interval = 1000)
+
     while True:
         match input("\nEnter command: "): 
             case "":
                 try:
-                    step(cpu)
+                    step(cpu, history)
                 except Exception as exc:
                     display_step_error()
                     print(exc)
 
+            case "back":
+                try:
+                    history.step_back()
+                    display_state(cpu)
+                except ValueError as exc:
+                    print(f'\n{exc}')
+
             case "exit":
                 break
 
@@ -177,16 +203,76 @@ def step_mode(cpu):
                 display_invalid_input_error()
 
 
-def step(cpu):
+def step(cpu, history):
     if not cpu.halt:
-        cpu.fetch_instruction()
-        cpu.execute_instruction()
+        history.step()
+        cpu.output.flush()
         display_state(cpu)
 
     else:
         print('\nCPU is halted. Type "reset" to start over or "exit" to exit the program.')
 
 
+def add_watchpoint(cpu):
+    print('\nEnter the first and last address to watch (the same address twice to watch a single byte)')
+
+    start = get_address_from_user()
+    if start == -1:
+        return
+
+    end = get_address_from_user()
+    if end == -1:
+        return
+
+    kinds = input('\nWatch for reads (r), writes (w), and/or executes (x) - e.g. "rw": ')
+
+    if not kinds or set(kinds) - set("rwx"):
+        print('\nInvalid watchpoint type')
+        return
+
+    try:
+        cpu.watch(start, end, kinds)
+        print(f'\nWatching {start:04x} - {end:04x} ({kinds})')
+    except ValueError as exc:
+        print(exc)
+
+
+def display_watch_hit(cpu):
+    pc, address, kind, value = cpu.watch_hit
+    access = {"r": "Read", "w": "Write", "x": "Execute"}[kind]
+
+    print(f'\nStopped at watchpoint: {access} of {value:02x} at {address:04x} (PC {pc:04x})')
+    print('  Type "cpu" to view the state of your CPU.')
+
+
+def add_breakpoint(cpu):
+    print('\nEnter a breakpoint condition, e.g. "PC == 0123 and A > 80 and F.zero" (hex numbers need a 0x prefix), \
+    \n  or just an address to always break there')
+
+    condition = input('\nCondition: ')
+
+    try:
+        address = int(condition, 16)
+        condition = None
+    except ValueError:
+        address = None
+
+    try:
+        after = int(input('\nBreak after how many hits? (default 1): ') or 1)
+        breakpoint = cpu.add_breakpoint(address, condition, after)
+        print(f'\nBreakpoint added at {breakpoint}')
+    except (SyntaxError, ValueError) as exc:
+        print('\nInvalid breakpoint')
+        print(exc)
+
+
+def display_breakpoint_hit(cpu):
+    breakpoint = cpu.breakpoint_hit
+
+    print(f'\nStopped at breakpoint {breakpoint} (hit {breakpoint.hits} times)')
+    print('  Type "cpu" to view the state of your CPU.')
+
+
 def display_state(cpu, start = 0, end = None):
     print('\nFlags')
     cpu.F.dump()
@@ -299,6 +385,8 @@ def display_program_help():
     \n  "step" to load the program into memory and run it step by step \
     \n  "run" to load the program into memory and run it from start to finish \
     \n  "cpu" to display the current state of the CPU (flags, registers, & memory) \
+    \n  "watch" to stop "run" when a range of memory is read, written, or executed \
+    \n  "break" to stop "run" at an address, optionally only when a condition is true \
     \n  "reset" to reset the CPU (clear all flags, registers, and memory) \
     \n  "exit" to exit program mode \
     \n  "help" to repeat this message')
@@ -320,6 +408,7 @@ def display_program_save_error():
 def display_step_help():
     print('\nStep-by-Step Operation Mode \
     \n\nHit enter to execute the next instruction. Or type: \
+    \n  "back" to undo the last instruction \
     \n  "reset" to reset the CPU \
     \n  "exit" to exit step mode \
     \n  "help" to repeat this message')